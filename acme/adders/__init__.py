@@ -17,5 +17,6 @@
 # pylint: disable=unused-import
 
 from acme.adders.base import Adder
+from acme.adders.wrappers import AsyncAdder
 from acme.adders.wrappers import ForkingAdder
 from acme.adders.wrappers import IgnoreExtrasAdder
@@ -114,6 +114,10 @@ class NStepTransitionAdder(base.ReverbAdder):
     # upcast if rewards/discounts are float64 and left alone otherwise.
     self.n_step = n_step
     self._discount = tree.map_structure(np.float32, discount)
+    # Powers discount**i for i < n_step, along a new leading axis.
+    self._discount_powers = tree.map_structure(
+        lambda d: d**np.arange(n_step, dtype=np.float32).reshape(
+            (n_step,) + (1,) * np.ndim(d)), self._discount)
     self._first_idx = 0
     self._last_idx = 0
 
@@ -220,38 +224,38 @@ class NStepTransitionAdder(base.ReverbAdder):
   ) -> Tuple[types.NestedArray, types.NestedArray]:
 
     # Give the same tree structure to the n-step return accumulator,
-    # n-step discount accumulator, and self.discount, so that they can be
+    # n-step discount accumulator, and the discount powers, so that they can be
     # iterated in parallel using tree.map_structure.
-    rewards, discounts, self_discount = tree_utils.broadcast_structures(
-        rewards, discounts, self._discount)
+    rewards, discounts, discount_powers = tree_utils.broadcast_structures(
+        rewards, discounts, self._discount_powers)
     flat_rewards = tree.flatten(rewards)
     flat_discounts = tree.flatten(discounts)
-    flat_self_discount = tree.flatten(self_discount)
-
-    # Copy total_discount as it is otherwise read-only.
-    total_discount = [np.copy(a[0]) for a in flat_discounts]
-
-    # Broadcast n_step_return to have the broadcasted shape of
-    # reward * discount.
-    n_step_return = [
-        np.copy(np.broadcast_to(r[0],
-                                np.broadcast(r[0], d).shape))
-        for r, d in zip(flat_rewards, total_discount)
-    ]
+    flat_discount_powers = tree.flatten(discount_powers)
 
+    # The return weights reward i by self_discount**i * prod_{j<i} discount[j],
+    # and the total discount is self_discount**(n-1) * prod_{j<n} discount[j].
     # NOTE: total_discount will have one less self_discount applied to it than
     # the value of self._n_step. This is so that when the learner/update uses
-    # an additional discount we don't apply it twice. Inside the following loop
-    # we will apply this right before summing up the n_step_return.
-    for i in range(1, self._n_step):
-      for nsr, td, r, d, sd in zip(n_step_return, total_discount, flat_rewards,
-                                   flat_discounts, flat_self_discount):
-        # Equivalent to: `total_discount *= self._discount`.
-        td *= sd
-        # Equivalent to: `n_step_return += reward[i] * total_discount`.
-        nsr += r[i] * td
-        # Equivalent to: `total_discount *= discount[i]`.
-        td *= d[i]
+    # an additional discount we don't apply it twice.
+    n_step_return = []
+    total_discount = []
+    for r, d, powers in zip(flat_rewards, flat_discounts, flat_discount_powers):
+      if len(d) == 1 and r.shape == d.shape:
+        # A one-step transition is just its reward and discount.
+        n_step_return.append(r[0])
+        total_discount.append(d[0])
+        continue
+
+      self_discounts = _expand_steps(powers[:len(d)], d.ndim).astype(d.dtype)
+      cumulative_discounts = np.cumprod(d, axis=0)
+      weights = self_discounts * np.concatenate(
+          [np.ones_like(d[:1]), cumulative_discounts[:-1]])
+      ndim = max(r.ndim, weights.ndim)
+      n_step_return.append(np.asarray(
+          np.sum(_expand_steps(r, ndim) * _expand_steps(weights, ndim), axis=0),
+          dtype=r.dtype))
+      total_discount.append(
+          np.asarray(self_discounts[-1] * cumulative_discounts[-1]))
 
     n_step_return = tree.unflatten_as(rewards, n_step_return)
     total_discount = tree.unflatten_as(rewards, total_discount)
@@ -293,6 +297,11 @@ class NStepTransitionAdder(base.ReverbAdder):
                                         transition_spec)
 
 
+def _expand_steps(x: np.ndarray, ndim: int) -> np.ndarray:
+  """Adds unit axes after the leading (step) axis of `x` up to `ndim` axes."""
+  return x.reshape(x.shape[:1] + (1,) * (ndim - x.ndim) + x.shape[1:])
+
+
 def _broadcast_specs(*args: specs.Array) -> specs.Array:
   """Like np.broadcast, but for specs.Array.
 
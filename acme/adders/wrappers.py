@@ -14,11 +14,15 @@
 
 """A library of useful adder wrappers."""
 
-from typing import Iterable
+import functools
+from typing import Any, Iterable, Tuple
 
 from acme import types
 from acme.adders import base
+from acme.utils import async_utils
 import dm_env
+import numpy as np
+import tree
 
 
 class ForkingAdder(base.Adder):
@@ -60,3 +64,58 @@ class IgnoreExtrasAdder(base.Adder):
           next_timestep: dm_env.TimeStep,
           extras: types.NestedArray = ()):
     self._adder.add(action, next_timestep)
+
+
+class AsyncAdder(base.Adder):
+  """An adder that forwards calls to another adder on a background thread.
+
+  A single worker thread applies the calls in order, so the wrapped adder sees
+  exactly the sequence of calls it would have seen synchronously; the caller
+  just no longer blocks on serialization and replay RPCs. Observations and
+  extras are copied before being queued in case the caller reuses buffers.
+  The bounded queue blocks the caller when the worker falls behind, and any
+  error raised by the wrapped adder is re-raised on the caller's next call.
+  """
+
+  def __init__(self, adder: base.Adder, max_queue_size: int = 16):
+    self._dispatcher = async_utils.BackgroundDispatcher(
+        functools.partial(_apply_call, adder), queue_size=max_queue_size)
+
+  def _put(self, method: str, *args):
+    self._dispatcher.put((method, args))
+
+  def flush(self):
+    """Blocks until all queued calls have been applied."""
+    self._dispatcher.flush()
+
+  def close(self):
+    """Applies all queued calls, then stops the worker and drops the adder.
+
+    Once this returns the wrapped adder has been released (so e.g. a reverb
+    adder has flushed its writer) and nothing more will be written.
+    """
+    self._dispatcher.close()
+
+  def reset(self):
+    self._put('reset')
+
+  def add_first(self, timestep: dm_env.TimeStep):
+    timestep = timestep._replace(observation=_copy(timestep.observation))
+    self._put('add_first', timestep)
+
+  def add(self,
+          action: types.NestedArray,
+          next_timestep: dm_env.TimeStep,
+          extras: types.NestedArray = ()):
+    next_timestep = next_timestep._replace(
+        observation=_copy(next_timestep.observation))
+    self._put('add', action, next_timestep, _copy(extras))
+
+
+def _copy(nest: types.NestedArray) -> types.NestedArray:
+  return tree.map_structure(np.copy, nest)
+
+
+def _apply_call(adder: base.Adder, call: Tuple[str, Tuple[Any, ...]]):
+  method, args = call
+  getattr(adder, method)(*args)
@@ -0,0 +1,118 @@
+# Copyright 2018 DeepMind Technologies Limited. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for adder wrappers."""
+
+import threading
+import weakref
+
+from acme import types
+from acme.adders import base
+from acme.adders import wrappers
+import dm_env
+import numpy as np
+
+from absl.testing import absltest
+
+
+class _RecordingAdder(base.Adder):
+  """Records calls, optionally failing on `add` or blocking until released."""
+
+  def __init__(self, fail_on_add: bool = False):
+    self.calls = []
+    self.release = threading.Event()
+    self.release.set()
+    self._fail_on_add = fail_on_add
+
+  def reset(self):
+    self.calls.append(('reset',))
+
+  def add_first(self, timestep: dm_env.TimeStep):
+    self.release.wait()
+    self.calls.append(('add_first', timestep.observation))
+
+  def add(self,
+          action: types.NestedArray,
+          next_timestep: dm_env.TimeStep,
+          extras: types.NestedArray = ()):
+    self.release.wait()
+    if self._fail_on_add:
+      raise RuntimeError('add failed')
+    self.calls.append(('add', action, next_timestep.observation, extras))
+
+
+class AsyncAdderTest(absltest.TestCase):
+
+  def test_calls_applied_in_order(self):
+    recorder = _RecordingAdder()
+    adder = wrappers.AsyncAdder(recorder)
+
+    observation = np.zeros(2, dtype=np.float32)
+    adder.add_first(dm_env.restart(observation))
+    for i in range(1, 4):
+      observation[:] = i  # The caller reuses its buffer.
+      adder.add(i, dm_env.transition(0., observation), extras={'i': i})
+    adder.reset()
+    adder.flush()
+
+    self.assertEqual([c[0] for c in recorder.calls],
+                     ['add_first', 'add', 'add', 'add', 'reset'])
+    np.testing.assert_array_equal(recorder.calls[0][1], [0., 0.])
+    for i, call in enumerate(recorder.calls[1:4], start=1):
+      _, action, observation, extras = call
+      self.assertEqual(action, i)
+      np.testing.assert_array_equal(observation, [i, i])
+      self.assertEqual(extras, {'i': i})
+
+  def test_flush_waits_for_pending_calls(self):
+    recorder = _RecordingAdder()
+    recorder.release.clear()
+    adder = wrappers.AsyncAdder(recorder)
+
+    adder.add_first(dm_env.restart(np.zeros(2)))
+    self.assertEmpty(recorder.calls)
+
+    recorder.release.set()
+    adder.flush()
+    self.assertLen(recorder.calls, 1)
+
+  def test_error_reraised_on_next_call(self):
+    adder = wrappers.AsyncAdder(_RecordingAdder(fail_on_add=True))
+    adder.add_first(dm_env.restart(np.zeros(2)))
+    adder.add(0, dm_env.transition(0., np.zeros(2)))
+
+    with self.assertRaisesRegex(RuntimeError, 'add failed'):
+      adder.flush()
+    # The error is only raised once; the adder keeps working afterwards.
+    adder.reset()
+    adder.flush()
+
+  def test_close_applies_pending_calls_and_drops_adder(self):
+    recorder = _RecordingAdder()
+    recorder.release.clear()
+    adder = wrappers.AsyncAdder(recorder)
+    adder.add_first(dm_env.restart(np.zeros(2)))
+
+    calls = recorder.calls
+    recorder_ref = weakref.ref(recorder)
+    del recorder
+    recorder_ref().release.set()
+    adder.close()
+
+    self.assertLen(calls, 1)
+    self.assertIsNone(recorder_ref())
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -14,7 +14,7 @@
 
 """A MCTS actor."""
 
-from typing import Optional, Tuple, List, Callable
+from typing import Any, Optional, Sequence, Tuple, List, Callable
 
 import acme
 from acme import adders
@@ -22,15 +22,157 @@ from acme import specs
 from acme.agents.tf.mcts import models
 from acme.agents.tf.mcts import search
 from acme.agents.tf.mcts import types
+from acme.tf import utils as tf2_utils
 from acme.tf import variable_utils as tf2_variable_utils
 
 import dm_env
 import numpy as np
-from scipy import special
 import sonnet as snt
 import tensorflow as tf
 
 
+def _cast_floating(x: tf.Tensor, dtype: tf.DType) -> tf.Tensor:
+  return tf.cast(x, dtype) if x.dtype.is_floating else x
+
+
+def _with_compute_dtype(
+    module: snt.Module, dtype: Optional[tf.DType]) -> Callable[..., Any]:
+  """Wraps a module so that it computes in `dtype` and returns float32.
+
+  The module's variables are left as they are (and shared with the learner);
+  they are only cast when read inside the wrapped call.
+
+  Args:
+    module: the module to wrap.
+    dtype: the compute dtype, e.g. `tf.bfloat16`; `None` leaves it unchanged.
+  """
+  if dtype is None:
+    return module
+
+  def call(*inputs):
+    inputs = tf.nest.map_structure(lambda x: _cast_floating(x, dtype), inputs)
+    with snt.custom_variable_getter(lambda v: _cast_floating(v, dtype)):
+      outputs = module(*inputs)
+    return tf.nest.map_structure(
+        lambda x: _cast_floating(x, tf.float32), outputs)
+
+  return call
+
+
+def _make_policy_value_fn(
+    network: snt.Module,
+    input_spec: Optional[tf.TensorSpec] = None,
+    compute_dtype: Optional[tf.DType] = None,
+) -> Callable[[types.Observation], Tuple[tf.Tensor, tf.Tensor]]:
+  """Returns a graph-compiled function mapping an observation to (probs, value).
+
+  Batching, the network forward pass and the softmax are traced into a single
+  graph, so each leaf evaluation costs one graph call and one host transfer.
+
+  Args:
+    network: a policy-value network taking a batch of inputs.
+    input_spec: optional spec of a single (unbatched) input; when given it is
+      used as the input signature so that the function is never retraced.
+    compute_dtype: optional dtype to run the network forward pass in.
+  """
+  input_signature = None if input_spec is None else [input_spec]
+  network = _with_compute_dtype(network, compute_dtype)
+
+  @tf.function(input_signature=input_signature)
+  def policy_value(observation: tf.Tensor) -> Tuple[tf.Tensor, tf.Tensor]:
+    logits, value = network(tf.expand_dims(observation, axis=0))
+    probs = tf.nn.softmax(tf.squeeze(logits, axis=0), axis=-1)
+    return probs, tf.reshape(value, [])
+
+  return policy_value
+
+
+def _make_repr_policy_value_fn(
+    repr_network: snt.Module,
+    eval_network: snt.Module,
+    input_spec: tf.TensorSpec,
+    compute_dtype: Optional[tf.DType] = None,
+) -> Callable[[types.Observation], Tuple[tf.Tensor, tf.Tensor, tf.Tensor]]:
+  """Returns a graph-compiled function for evaluating the root of a search.
+
+  The function maps an observation to (hidden state, probs, value), running the
+  representation and evaluation networks back to back in a single graph call,
+  optionally in `compute_dtype`.
+  """
+  repr_network = _with_compute_dtype(repr_network, compute_dtype)
+  eval_network = _with_compute_dtype(eval_network, compute_dtype)
+
+  @tf.function(input_signature=[input_spec])
+  def repr_policy_value(
+      observation: tf.Tensor) -> Tuple[tf.Tensor, tf.Tensor, tf.Tensor]:
+    hidden_state = repr_network(tf.expand_dims(observation, axis=0))
+    logits, value = eval_network(hidden_state)
+    probs = tf.nn.softmax(tf.squeeze(logits, axis=0), axis=-1)
+    return tf.squeeze(hidden_state, axis=0), probs, tf.reshape(value, [])
+
+  return repr_policy_value
+
+
+def _make_batched_policy_value_fn(
+    network: snt.Module,
+    input_spec: tf.TensorSpec,
+    compute_dtype: Optional[tf.DType] = None,
+) -> Callable[[np.ndarray], Tuple[tf.Tensor, tf.Tensor]]:
+  """Returns a graph-compiled function mapping a batch to (probs, values).
+
+  Like `_make_policy_value_fn`, but takes a batch of observations of any size
+  (so it is traced once) and returns probs [B, A] and values [B].
+  """
+  network = _with_compute_dtype(network, compute_dtype)
+  batch_spec = tf.TensorSpec(
+      (None,) + tuple(input_spec.shape), input_spec.dtype)
+
+  @tf.function(input_signature=[batch_spec])
+  def policy_value(observations: tf.Tensor) -> Tuple[tf.Tensor, tf.Tensor]:
+    logits, values = network(observations)
+    return tf.nn.softmax(logits, axis=-1), tf.reshape(values, [-1])
+
+  return policy_value
+
+
+def _make_batched_repr_policy_value_fn(
+    repr_network: snt.Module,
+    eval_network: snt.Module,
+    input_spec: tf.TensorSpec,
+    compute_dtype: Optional[tf.DType] = None,
+) -> Callable[[np.ndarray], Tuple[tf.Tensor, tf.Tensor, tf.Tensor]]:
+  """Returns a graph-compiled function for evaluating a batch of search roots.
+
+  Like `_make_repr_policy_value_fn`, but maps a batch of observations of any
+  size to hidden states [B, ...], probs [B, A] and values [B].
+  """
+  repr_network = _with_compute_dtype(repr_network, compute_dtype)
+  eval_network = _with_compute_dtype(eval_network, compute_dtype)
+  batch_spec = tf.TensorSpec(
+      (None,) + tuple(input_spec.shape), input_spec.dtype)
+
+  @tf.function(input_signature=[batch_spec])
+  def repr_policy_value(
+      observations: tf.Tensor) -> Tuple[tf.Tensor, tf.Tensor, tf.Tensor]:
+    hidden_states = repr_network(observations)
+    logits, values = eval_network(hidden_states)
+    return (hidden_states, tf.nn.softmax(logits, axis=-1),
+            tf.reshape(values, [-1]))
+
+  return repr_policy_value
+
+
+def _quantize(probs: types.Probs) -> np.ndarray:
+  """Quantizes a policy to uint8 for storage in replay.
+
+  Each distribution (the last axis) is scaled so that its most likely action
+  maps to `PROBS_QUANTIZATION_SCALE`, so no row quantizes to all zeros however
+  flat it is; the learner renormalizes.
+  """
+  scale = types.PROBS_QUANTIZATION_SCALE / np.max(probs, axis=-1, keepdims=True)
+  return np.round(probs * scale).astype(np.uint8)
+
+
 class MCTSActor(acme.Actor):
   """Executes a policy- and value-network guided MCTS search."""
 
@@ -45,11 +187,14 @@ class MCTSActor(acme.Actor):
       num_simulations: int,
       adder: Optional[adders.Adder] = None,
       variable_client: Optional[tf2_variable_utils.VariableClient] = None,
+      forward_dtype: Optional[tf.DType] = None,
   ):
 
     # Internalize components: model, network, data sink and variable source.
     self._model = model
-    self._network = tf.function(network)
+    self._policy_value = _make_policy_value_fn(
+        network, tf.TensorSpec.from_spec(environment_spec.observations),
+        compute_dtype=forward_dtype)
     self._variable_client = variable_client
     self._adder = adder
 
@@ -59,6 +204,13 @@ class MCTSActor(acme.Actor):
     self._actions = list(range(self._num_actions))
     self._discount = discount
 
+    # Build the search once; its tree is cleared and reused on every step.
+    self._search = search.make_search_fn(
+        num_actions=self._num_actions,
+        num_simulations=num_simulations,
+        discount=discount,
+    )
+
     # We need to save the policy so as to add it to replay on the next step.
     self._probs = np.ones(
         shape=(self._num_actions,), dtype=np.float32) / self._num_actions
@@ -66,14 +218,8 @@ class MCTSActor(acme.Actor):
   def _forward(
       self, observation: types.Observation) -> Tuple[types.Probs, types.Value]:
     """Performs a forward pass of the policy-value network."""
-    logits, value = self._network(tf.expand_dims(observation, axis=0))
-
-    # Convert to numpy & take softmax.
-    logits = logits.numpy().squeeze(axis=0)
-    value = value.numpy().item()
-    probs = special.softmax(logits)
-
-    return probs, value
+    probs, value = self._policy_value(observation)
+    return probs.numpy(), value.numpy().item()
 
   def select_action(self, observation: types.Observation) -> types.Action:
     """Computes the agent's policy via MCTS."""
@@ -81,18 +227,10 @@ class MCTSActor(acme.Actor):
       self._model.reset(observation)
     
     # Compute a fresh MCTS plan.
-    root = search.mcts(
-        observation,
-        model=self._model,
-        search_policy=search.puct,
-        evaluation=self._forward,
-        num_simulations=self._num_simulations,
-        num_actions=self._num_actions,
-        discount=self._discount,
-    )
+    tree = self._search(observation, self._model, self._forward)
 
     # The agent's policy is softmax w.r.t. the *visit counts* as in AlphaZero.
-    probs = search.visit_count_policy(root)
+    probs = search.visit_count_policy(tree)
     action = np.int32(np.random.choice(self._actions, p=probs))
 
     # Save the policy probs so that we can add them to replay in `observe()`.
@@ -117,7 +255,8 @@ class MCTSActor(acme.Actor):
     self._prev_timestep = next_timestep
 
     if self._adder:
-      self._adder.add(action, next_timestep, extras={'pi': self._probs})
+      self._adder.add(
+          action, next_timestep, extras={'pi': _quantize(self._probs)})
 
 
 class ReprMCTSActor(acme.Actor):
@@ -135,12 +274,17 @@ class ReprMCTSActor(acme.Actor):
       num_simulations: int,
       adder: Optional[adders.Adder] = None,
       variable_client: Optional[tf2_variable_utils.VariableClient] = None,
+      forward_dtype: Optional[tf.DType] = None,
   ):
 
     # Internalize components: model, network, data sink and variable source.
     self._model = model
-    self._repr_network = tf.function(repr_network)
-    self._eval_network = tf.function(eval_network)
+    self._root_policy_value = _make_repr_policy_value_fn(
+        repr_network, eval_network,
+        tf.TensorSpec.from_spec(environment_spec.observations),
+        compute_dtype=forward_dtype)
+    self._policy_value = _make_policy_value_fn(
+        eval_network, compute_dtype=forward_dtype)
     self._variable_client = variable_client
     self._adder = adder
 
@@ -150,6 +294,13 @@ class ReprMCTSActor(acme.Actor):
     self._actions = list(range(self._num_actions))
     self._discount = discount
 
+    # Build the search once; its tree is cleared and reused on every step.
+    self._search = search.make_search_fn(
+        num_actions=self._num_actions,
+        num_simulations=num_simulations,
+        discount=discount,
+    )
+
     # We need to save the policy so as to add it to replay on the next step.
     self._probs = np.ones(
         shape=(self._num_actions,), dtype=np.float32) / self._num_actions
@@ -157,35 +308,28 @@ class ReprMCTSActor(acme.Actor):
   def _forward(
       self, hidden_state: types.Observation) -> Tuple[types.Probs, types.Value]:
     """Performs a forward pass of the policy-value network."""
-    logits, value = self._eval_network(tf.expand_dims(hidden_state, axis=0))
-
-    # Convert to numpy & take softmax.
-    logits = logits.numpy().squeeze(axis=0)
-    value = value.numpy().item()
-    probs = special.softmax(logits)
-
-    return probs, value
+    probs, value = self._policy_value(hidden_state)
+    return probs.numpy(), value.numpy().item()
 
   def select_action(self, observation: types.Observation) -> types.Action:
     """Computes the agent's policy via MCTS."""
     if self._model.needs_reset:
       self._model.reset(observation)
 
-    hidden_state = tf.squeeze(self._repr_network(tf.expand_dims(observation, axis=0)), axis=0)
-    
-    # Compute a fresh MCTS plan.
-    root = search.mcts(
+    # Embed the observation and evaluate the root in a single graph call.
+    hidden_state, prior, value = self._root_policy_value(observation)
+
+    # Compute a fresh MCTS plan. The root is not re-evaluated, so the hidden
+    # state is passed through as is, without copying it to host.
+    tree = self._search(
         hidden_state,
-        model=self._model,
-        search_policy=search.puct,
-        evaluation=self._forward,
-        num_simulations=self._num_simulations,
-        num_actions=self._num_actions,
-        discount=self._discount,
+        self._model,
+        self._forward,
+        root_evaluation=(prior.numpy(), value.numpy().item()),
     )
 
     # The agent's policy is softmax w.r.t. the *visit counts* as in AlphaZero.
-    probs = search.visit_count_policy(root)
+    probs = search.visit_count_policy(tree)
     action = np.int32(np.random.choice(self._actions, p=probs))
 
     # Save the policy probs so that we can add them to replay in `observe()`.
@@ -210,7 +354,204 @@ class ReprMCTSActor(acme.Actor):
     self._prev_timestep = next_timestep
 
     if self._adder:
-      self._adder.add(action, next_timestep, extras={'pi': self._probs})
+      self._adder.add(
+          action, next_timestep, extras={'pi': _quantize(self._probs)})
+
+
+class BatchedMCTSActor:
+  """Runs `MCTSActor`'s search for several environments in lockstep.
+
+  Each environment has its own model, search tree and (optional) adder, but
+  every simulation evaluates the leaves of all the trees with a single batched
+  call to the policy-value network. Environments are addressed by their index
+  in `environment_models`; see `environment_loop.LockstepEnvironmentLoop`.
+  """
+
+  def __init__(
+      self,
+      environment_spec: specs.EnvironmentSpec,
+      environment_models: Sequence[models.Model],
+      network: snt.Module,
+      discount: float,
+      num_simulations: int,
+      environment_adders: Optional[Sequence[adders.Adder]] = None,
+      variable_client: Optional[tf2_variable_utils.VariableClient] = None,
+      forward_dtype: Optional[tf.DType] = None,
+  ):
+    if (environment_adders is not None and
+        len(environment_adders) != len(environment_models)):
+      raise ValueError(
+          f'Expected one adder per model, got {len(environment_adders)} '
+          f'adders for {len(environment_models)} models.')
+
+    # Internalize components: models, network, data sinks and variable source.
+    self._models = list(environment_models)
+    self._policy_value = _make_batched_policy_value_fn(
+        network, tf.TensorSpec.from_spec(environment_spec.observations),
+        compute_dtype=forward_dtype)
+    self._variable_client = variable_client
+    self._adders = environment_adders
+
+    # Internalize hyperparameters.
+    self._num_actions = environment_spec.actions.num_values
+    self._actions = list(range(self._num_actions))
+
+    # Build the searches once; their trees are cleared and reused every step.
+    self._search = search.make_batched_search_fn(
+        num_searches=len(self._models),
+        num_actions=self._num_actions,
+        num_simulations=num_simulations,
+        discount=discount,
+    )
+
+    # We need to save the policies so as to add them to replay on the next step.
+    self._probs = np.ones(
+        shape=(len(self._models), self._num_actions),
+        dtype=np.float32) / self._num_actions
+    self._prev_timesteps: List[Optional[dm_env.TimeStep]] = (
+        [None] * len(self._models))
+
+  @property
+  def num_envs(self) -> int:
+    return len(self._models)
+
+  def _forward(
+      self, observations: Sequence[types.Observation]
+  ) -> Tuple[types.Probs, np.ndarray]:
+    """Performs a batched forward pass of the policy-value network."""
+    probs, values = self._policy_value(np.stack(observations))
+    return probs.numpy(), values.numpy()
+
+  def _plan(
+      self, observations: Sequence[types.Observation]) -> Sequence[search.Tree]:
+    """Computes fresh MCTS plans, sharing network calls across the batch."""
+    return self._search(observations, self._models, self._forward)
+
+  def select_actions(
+      self, observations: Sequence[types.Observation]) -> np.ndarray:
+    """Computes the agent's policy for every environment via lockstep MCTS."""
+    for model, observation in zip(self._models, observations):
+      if model.needs_reset:
+        model.reset(observation)
+
+    trees = self._plan(observations)
+
+    # The agent's policy is softmax w.r.t. the *visit counts* as in AlphaZero.
+    actions = np.zeros(len(trees), dtype=np.int32)
+    for i, tree in enumerate(trees):
+      probs = search.visit_count_policy(tree)
+      actions[i] = np.random.choice(self._actions, p=probs)
+
+      # Save the policy probs so that we can add them to replay in `observe()`.
+      self._probs[i] = probs
+
+    return actions
+
+  def update(self, wait: bool = False):
+    """Fetches the latest variables from the variable source, if needed."""
+    if self._variable_client:
+      self._variable_client.update(wait)
+
+  def observe_first(self, index: int, timestep: dm_env.TimeStep):
+    self._prev_timesteps[index] = timestep
+    if self._adders:
+      self._adders[index].add_first(timestep)
+
+  def observe(
+      self,
+      index: int,
+      action: types.Action,
+      next_timestep: dm_env.TimeStep,
+  ):
+    """Updates an environment's model and adds its transition to replay."""
+    self._models[index].update(
+        self._prev_timesteps[index], action, next_timestep)
+
+    self._prev_timesteps[index] = next_timestep
+
+    if self._adders:
+      self._adders[index].add(
+          action, next_timestep, extras={'pi': _quantize(self._probs[index])})
+
+
+class BatchedReprMCTSActor(BatchedMCTSActor):
+  """Runs `ReprMCTSActor`'s search for several environments in lockstep.
+
+  The roots are embedded and evaluated with one batched call, and the leaves of
+  all the trees with one batched call per simulation.
+  """
+
+  def __init__(
+      self,
+      environment_spec: specs.EnvironmentSpec,
+      environment_models: Sequence[models.Model],
+      repr_network: snt.Module,
+      eval_network: snt.Module,
+      discount: float,
+      num_simulations: int,
+      environment_adders: Optional[Sequence[adders.Adder]] = None,
+      variable_client: Optional[tf2_variable_utils.VariableClient] = None,
+      forward_dtype: Optional[tf.DType] = None,
+  ):
+    if (environment_adders is not None and
+        len(environment_adders) != len(environment_models)):
+      raise ValueError(
+          f'Expected one adder per model, got {len(environment_adders)} '
+          f'adders for {len(environment_models)} models.')
+
+    # Internalize components: models, networks, data sinks and variable source.
+    observation_spec = tf.TensorSpec.from_spec(environment_spec.observations)
+    hidden_state_spec = tf2_utils.create_variables(
+        repr_network, [environment_spec.observations])
+    self._models = list(environment_models)
+    self._root_policy_value = _make_batched_repr_policy_value_fn(
+        repr_network, eval_network, observation_spec,
+        compute_dtype=forward_dtype)
+    self._policy_value = _make_batched_policy_value_fn(
+        eval_network, hidden_state_spec, compute_dtype=forward_dtype)
+    self._variable_client = variable_client
+    self._adders = environment_adders
+
+    # Internalize hyperparameters.
+    self._num_actions = environment_spec.actions.num_values
+    self._actions = list(range(self._num_actions))
+
+    # Build the searches once; their trees are cleared and reused every step.
+    self._search = search.make_batched_search_fn(
+        num_searches=len(self._models),
+        num_actions=self._num_actions,
+        num_simulations=num_simulations,
+        discount=discount,
+    )
+
+    # We need to save the policies so as to add them to replay on the next step.
+    self._probs = np.ones(
+        shape=(len(self._models), self._num_actions),
+        dtype=np.float32) / self._num_actions
+    self._prev_timesteps: List[Optional[dm_env.TimeStep]] = (
+        [None] * len(self._models))
+
+  def _forward(
+      self, hidden_states: Sequence[types.Observation]
+  ) -> Tuple[types.Probs, np.ndarray]:
+    """Performs a batched forward pass of the policy-value network."""
+    probs, values = self._policy_value(tf.stack(hidden_states))
+    return probs.numpy(), values.numpy()
+
+  def _plan(
+      self, observations: Sequence[types.Observation]) -> Sequence[search.Tree]:
+    """Computes fresh MCTS plans, sharing network calls across the batch."""
+    # Embed the observations and evaluate the roots in a single graph call.
+    hidden_states, priors, values = self._root_policy_value(
+        np.stack(observations))
+
+    # The roots are not re-evaluated, so the hidden states stay on device.
+    return self._search(
+        tf.unstack(hidden_states),
+        self._models,
+        self._forward,
+        root_evaluations=(priors.numpy(), values.numpy()),
+    )
 
 
 class SampledMCTSActor(MCTSActor):
@@ -230,11 +571,14 @@ class SampledMCTSActor(MCTSActor):
       sampling_distribution: Callable[[types.Probs], types.Probs] = lambda x: x,
       adder: Optional[adders.Adder] = None,
       variable_client: Optional[tf2_variable_utils.VariableClient] = None,
+      forward_dtype: Optional[tf.DType] = None,
   ):
 
     # Internalize components: model, network, data sink and variable source.
     self._model = model
-    self._network = tf.function(network)
+    self._policy_value = _make_policy_value_fn(
+        network, tf.TensorSpec.from_spec(environment_spec.observations),
+        compute_dtype=forward_dtype)
     self._variable_client = variable_client
     self._adder = adder
 
@@ -251,39 +595,37 @@ class SampledMCTSActor(MCTSActor):
     self._probs = np.ones(
         shape=pi_shape, dtype=np.float32) / pi_shape[-1]  
         
-  def _forward(
-      self, observation: types.Observation) -> Tuple[types.Probs, types.Value]:
-    """Performs a forward pass of the policy-value network."""
-    logits, value = self._network(tf.expand_dims(observation, axis=0))
-
-    # Convert to numpy & take softmax.
-    logits = logits.numpy().squeeze(axis=0)
-    value = value.numpy().item()
-    probs = special.softmax(logits, axis=-1)
+  def _sample(
+      self, prior: types.Probs) -> Tuple[List[types.Action], List[types.Probs]]:
+    """Samples actions for every dimension at once, with replacement.
+
+    Draws `num_samples` actions per dimension from the sampling distribution
+    via the Gumbel-max trick, and returns the unique sampled actions of each
+    dimension with their priors reweighted as in Sampled MuZero.
+    """
+    dist = self._sampling_distribution(prior)
+    num_dimensions, num_actions = dist.shape
+
+    # argmax(log p + Gumbel noise) is a sample from p; draw all at once.
+    with np.errstate(divide='ignore'):
+      log_dist = np.log(dist)
+    gumbel = np.random.gumbel(
+        size=(num_dimensions, self._num_samples, num_actions))
+    samples = np.argmax(log_dist[:, None, :] + gumbel, axis=-1)
+    counts = np.sum(samples[..., None] == np.arange(num_actions), axis=1)
 
-    return probs, value
-  
-  def _sample(self, prior: types.Probs, )-> Tuple[List[types.Action], List[types.Probs]]:
-    dist = self._sampling_distribution(prior) 
     sampled_actions, priors = [], []
-    for dim in range(len(prior)):
-      dim_unique_actions, dim_priors = self._sample_per_dimension(prior[dim], dist[dim])
+    for dim_counts, dim_prior, dim_dist in zip(counts, prior, dist):
+      dim_unique_actions = np.flatnonzero(dim_counts)
+      empirical = dim_counts[dim_unique_actions] / self._num_samples
+      dim_priors = (empirical / dim_dist[dim_unique_actions] *
+                    dim_prior[dim_unique_actions])
+      search.check_numerics(dim_priors)
       sampled_actions.append(dim_unique_actions)
       priors.append(dim_priors)
 
     return sampled_actions, priors
-  
-  def _sample_per_dimension(
-      self, dim_prior: np.ndarray, sampling_dist: np.ndarray,
-  ) -> Tuple[np.ndarray, np.ndarray]:
-    dim_sampled_actions = np.random.choice(len(dim_prior), size=self._num_samples, p=sampling_dist)
-    dim_unique_actions, counts = np.unique(dim_sampled_actions, return_counts=True)
-    empirical = counts / len(dim_sampled_actions)
-    dim_priors = empirical / sampling_dist[dim_unique_actions] * dim_prior[dim_unique_actions]
-    search.check_numerics(dim_priors)
-
-    return dim_unique_actions, dim_priors
-  
+
   def _convert(self, raw_action: List[types.Action]) -> types.Action:
     action = [self._bins[dim][a] for dim, a in enumerate(raw_action)]
     if len(action) == 1: return action[0]
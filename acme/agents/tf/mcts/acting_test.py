@@ -0,0 +1,149 @@
+# Copyright 2018 DeepMind Technologies Limited. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for acting.py."""
+
+from acme import specs
+from acme.agents.tf.mcts import acting
+from acme.agents.tf.mcts.models import simulator
+from acme.testing import fakes
+from acme.tf import networks
+from acme.tf import utils as tf2_utils
+import numpy as np
+import sonnet as snt
+import tensorflow as tf
+
+from absl.testing import absltest
+
+
+def _tempered(prior: np.ndarray) -> np.ndarray:
+  dist = np.sqrt(prior)
+  return dist / dist.sum(axis=-1, keepdims=True)
+
+
+def _choice_sample(prior: np.ndarray, dist: np.ndarray, num_samples: int):
+  """The per-dimension `np.random.choice` estimator `_sample` replaced."""
+  sampled_actions, priors = [], []
+  for dim_prior, dim_dist in zip(prior, dist):
+    samples = np.random.choice(len(dim_prior), size=num_samples, p=dim_dist)
+    actions, counts = np.unique(samples, return_counts=True)
+    sampled_actions.append(actions)
+    priors.append(counts / num_samples / dim_dist[actions] * dim_prior[actions])
+  return sampled_actions, priors
+
+
+class _CountingLinear(snt.Module):
+  """A linear layer that also reads an integer variable."""
+
+  def __init__(self):
+    super().__init__()
+    self.w = tf.Variable(tf.ones([2, 2]))
+    self.count = tf.Variable(3, dtype=tf.int32)
+
+  def __call__(self, x: tf.Tensor) -> tf.Tensor:
+    self.dtypes = (self.w.dtype, self.count.dtype)
+    return tf.matmul(x, self.w) * tf.cast(self.count, x.dtype)
+
+
+class ForwardDtypeTest(absltest.TestCase):
+
+  def test_bfloat16_forward_returns_float32(self):
+    environment = fakes.DiscreteEnvironment(
+        num_actions=5,
+        num_observations=10,
+        obs_dtype=np.float32,
+        episode_length=10)
+    spec = specs.make_environment_spec(environment)
+    network = snt.Sequential([
+        snt.Flatten(),
+        snt.nets.MLP([50, 50]),
+        networks.PolicyValueHead(spec.actions.num_values),
+    ])
+    tf2_utils.create_variables(network, [spec.observations])
+    actor = acting.MCTSActor(
+        environment_spec=spec,
+        model=simulator.Simulator(environment),
+        network=network,
+        discount=1.,
+        num_simulations=5,
+        forward_dtype=tf.bfloat16)
+
+    timestep = environment.reset()
+    probs, value = actor._policy_value(timestep.observation)
+    self.assertEqual(probs.dtype, tf.float32)
+    self.assertEqual(value.dtype, tf.float32)
+    np.testing.assert_allclose(probs.numpy().sum(), 1., rtol=1e-2)
+    # The network's own variables are left in float32.
+    for variable in network.variables:
+      self.assertEqual(variable.dtype, tf.float32)
+
+    actor.observe_first(timestep)
+    action = actor.select_action(timestep.observation)
+    self.assertIn(action, range(spec.actions.num_values))
+
+  def test_only_floating_variables_are_cast(self):
+    module = _CountingLinear()
+    call = acting._with_compute_dtype(module, tf.bfloat16)
+    output = call(tf.ones([1, 2]))
+    self.assertEqual(module.dtypes, (tf.bfloat16, tf.int32))
+    self.assertEqual(output.dtype, tf.float32)
+    np.testing.assert_allclose(output.numpy(), [[6., 6.]])
+
+
+class SampledMCTSActorTest(absltest.TestCase):
+
+  def test_sample_statistics(self):
+    num_bins, num_samples, num_trials = 4, 20, 4000
+    environment = fakes.ContinuousEnvironment(action_dim=2, bounded=True)
+    spec = specs.make_environment_spec(environment)
+    actor = acting.SampledMCTSActor(
+        environment_spec=spec,
+        model=simulator.Simulator(environment),
+        network=snt.Sequential([]),
+        discount=1.,
+        num_simulations=1,
+        pi_shape=(2, num_bins),
+        num_samples=num_samples,
+        sampling_distribution=_tempered)
+
+    prior = np.array([[0.1, 0.2, 0.3, 0.4], [0.7, 0.1, 0.1, 0.1]])
+    dist = _tempered(prior)
+
+    def dense_mean(sample_fn):
+      frequencies, priors = np.zeros_like(prior), np.zeros_like(prior)
+      for _ in range(num_trials):
+        sampled_actions, sampled_priors = sample_fn()
+        for dim, (actions, dim_priors) in enumerate(
+            zip(sampled_actions, sampled_priors)):
+          # Recover the empirical frequency from the reweighted prior.
+          frequencies[dim, actions] += (
+              dim_priors / prior[dim, actions] * dist[dim, actions])
+          priors[dim, actions] += dim_priors
+      return frequencies / num_trials, priors / num_trials
+
+    np.random.seed(0)
+    frequencies, priors = dense_mean(lambda: actor._sample(prior))
+    np.random.seed(1)
+    _, choice_priors = dense_mean(
+        lambda: _choice_sample(prior, dist, num_samples))
+
+    # Gumbel-max samples follow the sampling distribution, and the reweighted
+    # priors are unbiased estimates of the prior, like the old estimator's.
+    np.testing.assert_allclose(frequencies, dist, atol=0.01)
+    np.testing.assert_allclose(priors, prior, atol=0.01)
+    np.testing.assert_allclose(priors, choice_priors, atol=0.015)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -14,8 +14,15 @@
 
 """A single-process MCTS agent."""
 
+import functools
+import math
+import threading
+from typing import Iterable, Optional, Tuple
+
+from acme import adders as adders_lib
 from acme import datasets
 from acme import specs
+from acme import types
 from acme.adders import reverb as adders
 from acme.agents import agent
 from acme.agents.tf.mcts import acting
@@ -26,6 +33,155 @@ from acme.tf import utils as tf2_utils
 import numpy as np
 import reverb
 import sonnet as snt
+import tensorflow as tf
+
+
+class _ReverbServerPool:
+  """Recycles single-table replay servers across agent lifetimes.
+
+  Tables cannot be added to a `reverb.Server` once it is running, so servers
+  are never shared by live agents. Instead, the server of a deleted agent is
+  returned to the pool and handed, emptied, to the next agent whose table has
+  the same capacity, priority exponent and signature. This saves a port,
+  thread pools and memory per agent when many agents are built in one process
+  (e.g. in sweeps).
+
+  At most `max_idle_servers` released servers are kept; older ones are stopped
+  so that sweeps over table configs do not accumulate servers.
+  """
+
+  def __init__(self, max_idle_servers: int = 1):
+    self._lock = threading.Lock()
+    self._max_idle_servers = max_idle_servers
+    # Released servers with their table keys, oldest first.
+    self._idle = []
+    self._keys = {}
+
+  def acquire(
+      self,
+      replay_capacity: int,
+      priority_exponent: float,
+      signature: types.NestedSpec,
+  ) -> reverb.Server:
+    """Returns an empty server with a single prioritized table."""
+    key = (replay_capacity, priority_exponent, repr(signature))
+    server = None
+    with self._lock:
+      for i, (idle_key, _) in enumerate(self._idle):
+        if idle_key == key:
+          _, server = self._idle.pop(i)
+          break
+
+    if server is None:
+      replay_table = reverb.Table(
+          name=adders.DEFAULT_PRIORITY_TABLE,
+          sampler=reverb.selectors.Prioritized(priority_exponent),
+          remover=reverb.selectors.Fifo(),
+          max_size=replay_capacity,
+          rate_limiter=reverb.rate_limiters.MinSize(1),
+          signature=signature)
+      server = reverb.Server([replay_table], port=None)
+    else:
+      # Drop anything written by the previous owner, including items flushed
+      # by its adder while it was being torn down.
+      client = reverb.Client(f'localhost:{server.port}')
+      client.reset(adders.DEFAULT_PRIORITY_TABLE)
+
+    with self._lock:
+      self._keys[server.port] = key
+    return server
+
+  def release(self, server: reverb.Server):
+    """Returns a server to the pool once its owner no longer uses it."""
+    with self._lock:
+      key = self._keys.pop(server.port, None)
+      if key is None:
+        return
+      self._idle.append((key, server))
+      num_evicted = max(0, len(self._idle) - self._max_idle_servers)
+      evicted = self._idle[:num_evicted]
+      del self._idle[:num_evicted]
+
+    for _, evicted_server in evicted:
+      evicted_server.stop()
+
+
+_SERVER_POOL = _ReverbServerPool()
+
+
+def _release(adder: adders_lib.AsyncAdder, server: reverb.Server):
+  """Stops writing to `server`, then returns it to the pool.
+
+  The adder is closed first so that its pending writes, and the flush of its
+  reverb writer, cannot land in the table of the server's next owner.
+  """
+  try:
+    adder.close()
+  finally:
+    _SERVER_POOL.release(server)
+
+
+def _prefetch(dataset: tf.data.Dataset) -> tf.data.Dataset:
+  """Prefetches batches so that sampling overlaps with the learner step.
+
+  When a GPU is available the batches are also staged on it ahead of time;
+  this must be the final transformation of the dataset.
+
+  Args:
+    dataset: a dataset of batched replay samples.
+  """
+  dataset = dataset.prefetch(tf.data.AUTOTUNE)
+  if tf.config.list_logical_devices('GPU'):
+    dataset = dataset.apply(
+        tf.data.experimental.prefetch_to_device('/gpu:0', buffer_size=2))
+  return dataset
+
+
+def _make_pipeline(
+    address: str,
+    batch_size: int,
+    target_step_latency_ms: Optional[float],
+) -> Iterable[reverb.ReplaySample]:
+  """Returns batched, prefetched replay samples for the learner.
+
+  Replay is an endless stream of fresh samples, so nothing is cached.
+
+  Args:
+    address: address of the replay server.
+    batch_size: the batch size, or the initial batch size if adaptive.
+    target_step_latency_ms: if given, the batch size adapts within
+      [batch_size / 8, batch_size * 8] so that learner steps take about this
+      long; see `learning.AdaptiveBatcher`.
+  """
+  options = tf.data.Options()
+  options.experimental_optimization.map_parallelization = True
+  options.threading.private_threadpool_size = 0  # Use the shared threadpool.
+  dataset = datasets.make_reverb_dataset(server_address=address)
+  dataset = dataset.with_options(options)
+
+  if target_step_latency_ms is None:
+    return _prefetch(dataset.batch(batch_size, drop_remainder=True))
+  return learning.AdaptiveBatcher(
+      dataset,
+      batch_size=batch_size,
+      min_batch_size=max(1, batch_size // 8),
+      max_batch_size=8 * batch_size,
+      target_latency_ms=target_step_latency_ms,
+      transform=_prefetch)
+
+
+@functools.lru_cache(maxsize=None)
+def _pi_shape_for(
+    action_shape: Tuple[int, ...], k_bins: int) -> Tuple[Tuple[int, int], int]:
+  """Returns the factored policy shape and the default number of samples.
+
+  Args:
+    action_shape: shape of the action spec; `()` for discrete actions.
+    k_bins: number of bins per action dimension, or the number of actions for
+      discrete action specs.
+  """
+  pi_shape = (math.prod(action_shape), k_bins)
+  return pi_shape, math.prod(pi_shape)
 
 
 class MCTS(agent.Agent):
@@ -42,34 +198,35 @@ class MCTS(agent.Agent):
       num_simulations: int,
       environment_spec: specs.EnvironmentSpec,
       batch_size: int,
+      target_step_latency_ms: Optional[float] = None,
+      forward_dtype: Optional[tf.DType] = None,
+      priority_exponent: float = 0.6,
+      importance_sampling_exponent: float = 0.2,
   ):
 
     extra_spec = {
         'pi':
             specs.Array(
-                shape=(environment_spec.actions.num_values,), dtype=np.float32)
+                shape=(environment_spec.actions.num_values,), dtype=np.uint8)
     }
-    # Create a replay server for storing transitions.
-    replay_table = reverb.Table(
-        name=adders.DEFAULT_PRIORITY_TABLE,
-        sampler=reverb.selectors.Uniform(),
-        remover=reverb.selectors.Fifo(),
-        max_size=replay_capacity,
-        rate_limiter=reverb.rate_limiters.MinSize(1),
+    # Get a replay server for storing transitions.
+    self._server = _SERVER_POOL.acquire(
+        replay_capacity=replay_capacity,
+        priority_exponent=priority_exponent,
         signature=adders.NStepTransitionAdder.signature(
             environment_spec, extra_spec))
-    self._server = reverb.Server([replay_table], port=None)
 
-    # The adder is used to insert observations into replay.
+    # The adder is used to insert observations into replay; writes happen on a
+    # background thread so that acting does not block on replay.
     address = f'localhost:{self._server.port}'
-    adder = adders.NStepTransitionAdder(
+    adder = adders_lib.AsyncAdder(adders.NStepTransitionAdder(
         client=reverb.Client(address),
         n_step=n_step,
-        discount=discount)
+        discount=discount))
+    self._adder = adder
 
     # The dataset provides an interface to sample from replay.
-    dataset = datasets.make_reverb_dataset(server_address=address)
-    dataset = dataset.batch(batch_size, drop_remainder=True)
+    dataset = _make_pipeline(address, batch_size, target_step_latency_ms)
 
     tf2_utils.create_variables(network, [environment_spec.observations])
 
@@ -81,6 +238,7 @@ class MCTS(agent.Agent):
         discount=discount,
         adder=adder,
         num_simulations=num_simulations,
+        forward_dtype=forward_dtype,
     )
 
     learner = learning.AZLearner(
@@ -88,6 +246,8 @@ class MCTS(agent.Agent):
         optimizer=optimizer,
         dataset=dataset,
         discount=discount,
+        replay_client=reverb.Client(address),
+        importance_sampling_exponent=importance_sampling_exponent,
     )
 
     # The parent class combines these together into one 'agent'.
@@ -98,6 +258,11 @@ class MCTS(agent.Agent):
         observations_per_step=1,
     )
 
+  def __del__(self):
+    # The pool is already gone if this runs during interpreter shutdown.
+    if _SERVER_POOL is not None and hasattr(self, '_server'):
+      _release(self._adder, self._server)
+
 
 class ReprMCTS(agent.Agent):
   """A single-process MCTS agent with representation for raw observation."""
@@ -114,34 +279,35 @@ class ReprMCTS(agent.Agent):
       num_simulations: int,
       environment_spec: specs.EnvironmentSpec,
       batch_size: int,
+      target_step_latency_ms: Optional[float] = None,
+      forward_dtype: Optional[tf.DType] = None,
+      priority_exponent: float = 0.6,
+      importance_sampling_exponent: float = 0.2,
   ):
 
     extra_spec = {
         'pi':
             specs.Array(
-                shape=(environment_spec.actions.num_values,), dtype=np.float32)
+                shape=(environment_spec.actions.num_values,), dtype=np.uint8)
     }
-    # Create a replay server for storing transitions.
-    replay_table = reverb.Table(
-        name=adders.DEFAULT_PRIORITY_TABLE,
-        sampler=reverb.selectors.Uniform(),
-        remover=reverb.selectors.Fifo(),
-        max_size=replay_capacity,
-        rate_limiter=reverb.rate_limiters.MinSize(1),
+    # Get a replay server for storing transitions.
+    self._server = _SERVER_POOL.acquire(
+        replay_capacity=replay_capacity,
+        priority_exponent=priority_exponent,
         signature=adders.NStepTransitionAdder.signature(
             environment_spec, extra_spec))
-    self._server = reverb.Server([replay_table], port=None)
 
-    # The adder is used to insert observations into replay.
+    # The adder is used to insert observations into replay; writes happen on a
+    # background thread so that acting does not block on replay.
     address = f'localhost:{self._server.port}'
-    adder = adders.NStepTransitionAdder(
+    adder = adders_lib.AsyncAdder(adders.NStepTransitionAdder(
         client=reverb.Client(address),
         n_step=n_step,
-        discount=discount)
+        discount=discount))
+    self._adder = adder
 
     # The dataset provides an interface to sample from replay.
-    dataset = datasets.make_reverb_dataset(server_address=address)
-    dataset = dataset.batch(batch_size, drop_remainder=True)
+    dataset = _make_pipeline(address, batch_size, target_step_latency_ms)
 
     repr_output_spec = tf2_utils.create_variables(repr_network, [environment_spec.observations])
     eval_output_spec = tf2_utils.create_variables(eval_network, [repr_output_spec])
@@ -155,6 +321,7 @@ class ReprMCTS(agent.Agent):
         discount=discount,
         adder=adder,
         num_simulations=num_simulations,
+        forward_dtype=forward_dtype,
     )
 
     learner = learning.MZLearner(
@@ -163,6 +330,8 @@ class ReprMCTS(agent.Agent):
         optimizer=optimizer,
         dataset=dataset,
         discount=discount,
+        replay_client=reverb.Client(address),
+        importance_sampling_exponent=importance_sampling_exponent,
     )
 
     # The parent class combines these together into one 'agent'.
@@ -173,6 +342,11 @@ class ReprMCTS(agent.Agent):
         observations_per_step=1,
     )
 
+  def __del__(self):
+    # The pool is already gone if this runs during interpreter shutdown.
+    if _SERVER_POOL is not None and hasattr(self, '_server'):
+      _release(self._adder, self._server)
+
 
 class SampledMCTS(agent.Agent):
   """A single-process sampled MCTS agent."""
@@ -187,44 +361,48 @@ class SampledMCTS(agent.Agent):
       replay_capacity: int,
       num_simulations: int,
       environment_spec: specs.EnvironmentSpec,
-      batch_size: int, 
+      batch_size: int,
       k_bins: int = 5,
-      num_samples: int = 20,
+      num_samples: Optional[int] = 20,
+      target_step_latency_ms: Optional[float] = None,
+      forward_dtype: Optional[tf.DType] = None,
+      priority_exponent: float = 0.6,
+      importance_sampling_exponent: float = 0.2,
   ):
 
-    if isinstance(environment_spec.actions, specs.BoundedArray):
-        _pi_shape = (np.prod(environment_spec.actions.shape), k_bins)
-        num_samples = np.prod(_pi_shape) if num_samples is None else num_samples
-    elif isinstance(environment_spec.actions, specs.DiscreteArray):
-        _pi_shape = (1, environment_spec.actions.num_values) 
-        num_samples = environment_spec.actions.num_values if num_samples is None else num_samples
+    # Note: DiscreteArray subclasses BoundedArray, so it must be checked first.
+    if isinstance(environment_spec.actions, specs.DiscreteArray):
+      _pi_shape, default_num_samples = _pi_shape_for(
+          (), environment_spec.actions.num_values)
+    else:
+      _pi_shape, default_num_samples = _pi_shape_for(
+          environment_spec.actions.shape, k_bins)
+    if num_samples is None:
+      num_samples = default_num_samples
 
     extra_spec = {
         'pi':
             specs.Array(
-                shape=_pi_shape, dtype=np.float32)
+                shape=_pi_shape, dtype=np.uint8)
     }
-    # Create a replay server for storing transitions.
-    replay_table = reverb.Table(
-        name=adders.DEFAULT_PRIORITY_TABLE,
-        sampler=reverb.selectors.Uniform(),
-        remover=reverb.selectors.Fifo(),
-        max_size=replay_capacity,
-        rate_limiter=reverb.rate_limiters.MinSize(1),
+    # Get a replay server for storing transitions.
+    self._server = _SERVER_POOL.acquire(
+        replay_capacity=replay_capacity,
+        priority_exponent=priority_exponent,
         signature=adders.NStepTransitionAdder.signature(
             environment_spec, extra_spec))
-    self._server = reverb.Server([replay_table], port=None)
 
-    # The adder is used to insert observations into replay.
+    # The adder is used to insert observations into replay; writes happen on a
+    # background thread so that acting does not block on replay.
     address = f'localhost:{self._server.port}'
-    adder = adders.NStepTransitionAdder(
+    adder = adders_lib.AsyncAdder(adders.NStepTransitionAdder(
         client=reverb.Client(address),
         n_step=n_step,
-        discount=discount)
+        discount=discount))
+    self._adder = adder
 
     # The dataset provides an interface to sample from replay.
-    dataset = datasets.make_reverb_dataset(server_address=address)
-    dataset = dataset.batch(batch_size, drop_remainder=True)
+    dataset = _make_pipeline(address, batch_size, target_step_latency_ms)
 
     tf2_utils.create_variables(network, [environment_spec.observations])
 
@@ -238,6 +416,7 @@ class SampledMCTS(agent.Agent):
         num_simulations=num_simulations,
         pi_shape=_pi_shape,
         num_samples=num_samples,
+        forward_dtype=forward_dtype,
     )
 
     learner = learning.AZLearner(
@@ -245,6 +424,8 @@ class SampledMCTS(agent.Agent):
         optimizer=optimizer,
         dataset=dataset,
         discount=discount,
+        replay_client=reverb.Client(address),
+        importance_sampling_exponent=importance_sampling_exponent,
     )
 
     # The parent class combines these together into one 'agent'.
@@ -253,4 +434,9 @@ class SampledMCTS(agent.Agent):
         learner=learner,
         min_observations=10,
         observations_per_step=1,
-    )
\ No newline at end of file
+    )
+
+  def __del__(self):
+    # The pool is already gone if this runs during interpreter shutdown.
+    if _SERVER_POOL is not None and hasattr(self, '_server'):
+      _release(self._adder, self._server)
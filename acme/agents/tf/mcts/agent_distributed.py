@@ -21,6 +21,7 @@ from acme import datasets
 from acme import specs
 from acme.adders import reverb as adders
 from acme.agents.tf.mcts import acting
+from acme.agents.tf.mcts import environment_loop as mcts_environment_loop
 from acme.agents.tf.mcts import learning
 from acme.agents.tf.mcts import models
 from acme.tf import utils as tf2_utils
@@ -57,6 +58,7 @@ class DistributedMCTS:
       environment_spec: Optional[specs.EnvironmentSpec] = None,
       save_logs: bool = False,
       variable_update_period: int = 1000,
+      num_envs_per_actor: int = 1,
   ):
 
     if environment_spec is None:
@@ -84,6 +86,7 @@ class DistributedMCTS:
     self._discount = discount
     self._save_logs = save_logs
     self._variable_update_period = variable_update_period
+    self._num_envs_per_actor = num_envs_per_actor
 
   def replay(self):
     """The replay storage worker."""
@@ -94,13 +97,13 @@ class DistributedMCTS:
     extra_spec = {
         'pi':
             specs.Array(
-                shape=(self._env_spec.actions.num_values,), dtype='float32')
+                shape=(self._env_spec.actions.num_values,), dtype='uint8')
     }
     signature = adders.NStepTransitionAdder.signature(self._env_spec,
                                                       extra_spec)
     replay_table = reverb.Table(
         name=adders.DEFAULT_PRIORITY_TABLE,
-        sampler=reverb.selectors.Uniform(),
+        sampler=reverb.selectors.Prioritized(self._priority_exponent),
         remover=reverb.selectors.Fifo(),
         max_size=self._max_replay_size,
         rate_limiter=limiter,
@@ -130,6 +133,8 @@ class DistributedMCTS:
         dataset=dataset,
         optimizer=optimizer,
         counter=counter,
+        replay_client=replay,
+        importance_sampling_exponent=self._importance_sampling_exponent,
     )
 
   def actor(
@@ -137,13 +142,20 @@ class DistributedMCTS:
       replay: reverb.Client,
       variable_source: acme.VariableSource,
       counter: counting.Counter,
-  ) -> acme.EnvironmentLoop:
-    """The actor process."""
+  ) -> acme.Worker:
+    """The actor process.
 
-    # Build environment, model, network.
-    environment = self._environment_factory()
+    With `num_envs_per_actor > 1` the actor steps that many environments in
+    lockstep, batching the network evaluations of their searches.
+    """
+
+    # Build environments, models, network.
+    num_envs = self._num_envs_per_actor
+    environments = [self._environment_factory() for _ in range(num_envs)]
     network = self._network_factory(self._env_spec.actions)
-    model = self._model_factory(self._env_spec)
+    environment_models = [
+        self._model_factory(self._env_spec) for _ in range(num_envs)
+    ]
 
     # Create variable client for communicating with the learner.
     tf2_utils.create_variables(network, [self._env_spec.observations])
@@ -152,26 +164,42 @@ class DistributedMCTS:
         variables={'network': network.trainable_variables},
         update_period=self._variable_update_period)
 
-    # Component to add things into replay.
-    adder = adders.NStepTransitionAdder(
-        client=replay,
-        n_step=self._n_step,
-        discount=self._discount,
-    )
+    # Components to add things into replay, one per environment.
+    environment_adders = [
+        adders.NStepTransitionAdder(
+            client=replay,
+            n_step=self._n_step,
+            discount=self._discount,
+        ) for _ in range(num_envs)
+    ]
+
+    if num_envs > 1:
+      # Create the lockstep agent and the loop connecting it to environments.
+      actor = acting.BatchedMCTSActor(
+          environment_spec=self._env_spec,
+          environment_models=environment_models,
+          network=network,
+          discount=self._discount,
+          environment_adders=environment_adders,
+          variable_client=variable_client,
+          num_simulations=self._num_simulations,
+      )
+      return mcts_environment_loop.LockstepEnvironmentLoop(
+          environments, actor, counter)
 
     # Create the agent.
     actor = acting.MCTSActor(
         environment_spec=self._env_spec,
-        model=model,
+        model=environment_models[0],
         network=network,
         discount=self._discount,
-        adder=adder,
+        adder=environment_adders[0],
         variable_client=variable_client,
         num_simulations=self._num_simulations,
     )
 
     # Create the loop to connect environment and agent.
-    return acme.EnvironmentLoop(environment, actor, counter)
+    return acme.EnvironmentLoop(environments[0], actor, counter)
 
   def evaluator(
       self,
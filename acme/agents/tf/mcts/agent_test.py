@@ -14,14 +14,21 @@
 
 """Tests for the MCTS agent."""
 
+import gc
+import weakref
+
 import acme
 from acme import specs
+from acme.adders import reverb as adders
 from acme.agents.tf import mcts
+from acme.agents.tf.mcts import agent as mcts_agent
 from acme.agents.tf.mcts.models import simulator, mlp
 from acme.testing import fakes
 from acme.tf import networks
 import numpy as np
+import reverb
 import sonnet as snt
+import tensorflow as tf
 
 from absl.testing import absltest
 
@@ -64,6 +71,52 @@ class MCTSTest(absltest.TestCase):
     loop = acme.EnvironmentLoop(environment, agent)
     loop.run(num_episodes=2)
 
+  def test_reused_replay_starts_empty(self):
+    environment = fakes.DiscreteEnvironment(
+        num_actions=5,
+        num_observations=10,
+        obs_dtype=np.float32,
+        episode_length=10)
+    spec = specs.make_environment_spec(environment)
+
+    def make_agent():
+      network = snt.Sequential([
+          snt.Flatten(),
+          snt.nets.MLP([50]),
+          networks.PolicyValueHead(spec.actions.num_values),
+      ])
+      return mcts.MCTS(
+          environment_spec=spec,
+          network=network,
+          model=simulator.Simulator(environment),
+          optimizer=snt.optimizers.Adam(1e-3),
+          n_step=1,
+          discount=1.,
+          replay_capacity=100,
+          num_simulations=5,
+          batch_size=10)
+
+    agent = make_agent()
+    acme.EnvironmentLoop(environment, agent).run(num_episodes=2)
+    port = agent._server.port
+    learner = weakref.ref(agent._learner)
+
+    # Deleting the agent frees its learner (and the learner's dataset) and
+    # recycles its server straight away, without waiting for the cyclic GC.
+    gc.disable()
+    try:
+      del agent
+    finally:
+      gc.enable()
+    self.assertIsNone(learner())
+
+    # The next agent gets the same server, without the old agent's writes.
+    agent = make_agent()
+    self.assertEqual(agent._server.port, port)
+    client = reverb.Client(f'localhost:{port}')
+    table_info = client.server_info()[adders.DEFAULT_PRIORITY_TABLE]
+    self.assertEqual(table_info.current_size, 0)
+
   def test_repr_mcts(self):
     # Create a fake environment to test with.
     num_actions = 5
@@ -110,5 +163,76 @@ class MCTSTest(absltest.TestCase):
     loop = acme.EnvironmentLoop(environment, agent)
     loop.run(num_episodes=2)
 
+
+class DistributedMCTSTest(absltest.TestCase):
+
+  def test_replay_uses_priority_exponent(self):
+    environment = fakes.DiscreteEnvironment(
+        num_actions=5,
+        num_observations=10,
+        obs_dtype=np.float32,
+        episode_length=10)
+    agent = mcts.DistributedMCTS(
+        environment_factory=lambda: environment,
+        network_factory=lambda _: snt.Sequential([]),
+        model_factory=lambda _: None,
+        num_actors=1,
+        priority_exponent=0.3,
+        environment_spec=specs.make_environment_spec(environment))
+    table, = agent.replay()
+    self.assertAlmostEqual(
+        table.info.sampler_options.prioritized.priority_exponent, 0.3)
+
+
+class ReverbServerPoolTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self._pool = mcts_agent._ReverbServerPool(max_idle_servers=1)
+    self._signature = tf.TensorSpec((), tf.float32)
+
+  def _acquire(self, replay_capacity: int = 10) -> reverb.Server:
+    return self._pool.acquire(
+        replay_capacity=replay_capacity,
+        priority_exponent=0.6,
+        signature=self._signature)
+
+  def _table_size(self, server: reverb.Server) -> int:
+    client = reverb.Client(f'localhost:{server.port}')
+    return client.server_info()[adders.DEFAULT_PRIORITY_TABLE].current_size
+
+  def test_no_reuse_while_owned(self):
+    first = self._acquire()
+    second = self._acquire()
+    self.assertNotEqual(first.port, second.port)
+
+  def test_reuses_released_server_emptied(self):
+    server = self._acquire()
+    client = reverb.Client(f'localhost:{server.port}')
+    client.insert(np.float32(1.), {adders.DEFAULT_PRIORITY_TABLE: 1.})
+    self.assertEqual(self._table_size(server), 1)
+    self._pool.release(server)
+
+    reused = self._acquire()
+    self.assertIs(reused, server)
+    self.assertEqual(self._table_size(reused), 0)
+
+  def test_no_reuse_across_configs(self):
+    server = self._acquire(replay_capacity=10)
+    self._pool.release(server)
+    other = self._acquire(replay_capacity=20)
+    self.assertIsNot(other, server)
+
+  def test_evicts_idle_servers_over_limit(self):
+    first = self._acquire(replay_capacity=10)
+    second = self._acquire(replay_capacity=20)
+    self._pool.release(first)
+    self._pool.release(second)
+
+    # Only the most recently released server is kept.
+    self.assertIsNot(self._acquire(replay_capacity=10), first)
+    self.assertIs(self._acquire(replay_capacity=20), second)
+
+
 if __name__ == '__main__':
   absltest.main()
@@ -0,0 +1,156 @@
+# Copyright 2018 DeepMind Technologies Limited. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An environment loop stepping several environments in lockstep."""
+
+import operator
+import time
+from typing import Optional, Sequence
+
+from acme import core
+from acme.agents.tf.mcts import acting
+from acme.utils import counting
+from acme.utils import loggers
+from acme.utils import signals
+
+import dm_env
+import numpy as np
+import tree
+
+
+class LockstepEnvironmentLoop(core.Worker):
+  """Steps a `BatchedMCTSActor` (or subclass) and its environments in lockstep.
+
+  All environments are stepped once per call to `select_actions`, so the
+  actor's network evaluations are batched across them. An environment whose
+  episode ends is reset straight away and its episode is logged, as
+  `EnvironmentLoop` would; the others carry on with theirs.
+
+    loop = LockstepEnvironmentLoop(environments, actor)
+    loop.run(num_episodes)
+  """
+
+  def __init__(
+      self,
+      environments: Sequence[dm_env.Environment],
+      actor: acting.BatchedMCTSActor,
+      counter: Optional[counting.Counter] = None,
+      logger: Optional[loggers.Logger] = None,
+      should_update: bool = True,
+      label: str = 'environment_loop',
+  ):
+    if len(environments) != actor.num_envs:
+      raise ValueError(
+          f'Expected {actor.num_envs} environments, got {len(environments)}.')
+
+    # Internalize agent and environments.
+    self._environments = list(environments)
+    self._actor = actor
+    self._counter = counter or counting.Counter()
+    self._logger = logger or loggers.make_default_logger(
+        label, steps_key=self._counter.get_steps_key())
+    self._should_update = should_update
+
+  def _reset(self, index: int) -> dm_env.TimeStep:
+    environment = self._environments[index]
+    timestep = environment.reset()
+    self._actor.observe_first(index, timestep)
+    self._episode_steps[index] = 0
+    self._episode_returns[index] = tree.map_structure(
+        lambda s: np.zeros(s.shape, s.dtype), environment.reward_spec())
+    self._episode_starts[index] = time.time()
+    return timestep
+
+  def run(
+      self,
+      num_episodes: Optional[int] = None,
+      num_steps: Optional[int] = None,
+  ) -> int:
+    """Perform the run loop.
+
+    Run the environments either until `num_episodes` episodes have finished or
+    for at least `num_steps` steps, counted across all of them. Episodes still
+    in progress when the loop terminates are dropped. If neither is given this
+    will interact with the environments infinitely.
+
+    Args:
+      num_episodes: number of episodes to run the loop for.
+      num_steps: minimal number of steps to run the loop for.
+
+    Returns:
+      Actual number of steps the loop executed.
+
+    Raises:
+      ValueError: If both 'num_episodes' and 'num_steps' are not None.
+    """
+
+    if not (num_episodes is None or num_steps is None):
+      raise ValueError('Either "num_episodes" or "num_steps" should be None.')
+
+    def should_terminate(episode_count: int, step_count: int) -> bool:
+      return ((num_episodes is not None and episode_count >= num_episodes) or
+              (num_steps is not None and step_count >= num_steps))
+
+    num_envs = len(self._environments)
+    self._episode_steps = [0] * num_envs
+    self._episode_returns = [None] * num_envs
+    self._episode_starts = [0.] * num_envs
+
+    episode_count: int = 0
+    step_count: int = 0
+    with signals.runtime_terminator():
+      timesteps = [self._reset(i) for i in range(num_envs)]
+      while not should_terminate(episode_count, step_count):
+        # Generate actions for all environments with one lockstep search.
+        actions = self._actor.select_actions(
+            [timestep.observation for timestep in timesteps])
+
+        for i, (environment, action) in enumerate(
+            zip(self._environments, actions)):
+          # Step the environment and have the agent observe the timestep.
+          timesteps[i] = environment.step(action)
+          self._actor.observe(i, action, next_timestep=timesteps[i])
+          self._episode_steps[i] += 1
+          self._episode_returns[i] = tree.map_structure(
+              operator.iadd, self._episode_returns[i], timesteps[i].reward)
+
+          # Give the actor the opportunity to update itself once per
+          # environment step, so that variable update periods keep counting
+          # environment steps as in `EnvironmentLoop`.
+          if self._should_update:
+            self._actor.update()
+        step_count += num_envs
+
+        for i, timestep in enumerate(timesteps):
+          if not timestep.last():
+            continue
+
+          # Record counts and log the finished episode.
+          episode_steps = self._episode_steps[i]
+          counts = self._counter.increment(episodes=1, steps=episode_steps)
+          episode_duration = time.time() - self._episode_starts[i]
+          result = {
+              'episode_length': episode_steps,
+              'episode_return': self._episode_returns[i],
+              'steps_per_second': episode_steps / episode_duration,
+              'episode_duration': episode_duration,
+          }
+          result.update(counts)
+          self._logger.write(result)
+          episode_count += 1
+
+          # Start this environment's next episode.
+          timesteps[i] = self._reset(i)
+
+    return step_count
@@ -0,0 +1,144 @@
+# Copyright 2018 DeepMind Technologies Limited. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the lockstep MCTS environment loop."""
+
+from acme import specs
+from acme.adders import base
+from acme.agents.tf.mcts import acting
+from acme.agents.tf.mcts import environment_loop
+from acme.agents.tf.mcts.models import mlp
+from acme.agents.tf.mcts.models import simulator
+from acme.testing import fakes
+from acme.tf import networks
+from acme.utils import counting
+import numpy as np
+import sonnet as snt
+
+from absl.testing import absltest
+
+
+class _CountingAdder(base.Adder):
+
+  def __init__(self):
+    self.num_episodes = 0
+    self.num_adds = 0
+
+  def reset(self):
+    pass
+
+  def add_first(self, timestep):
+    self.num_episodes += 1
+
+  def add(self, action, next_timestep, extras=()):
+    self.num_adds += 1
+    assert extras['pi'].dtype == np.uint8
+
+
+class _CountingVariableClient:
+
+  def __init__(self):
+    self.num_updates = 0
+
+  def update(self, wait: bool = False):
+    del wait
+    self.num_updates += 1
+
+
+def _make_environments(episode_lengths):
+  return [
+      fakes.DiscreteEnvironment(
+          num_actions=5,
+          num_observations=10,
+          obs_dtype=np.float32,
+          episode_length=episode_length)
+      for episode_length in episode_lengths
+  ]
+
+
+def _make_eval_network(spec: specs.EnvironmentSpec) -> snt.Module:
+  return snt.Sequential([
+      snt.Flatten(),
+      snt.nets.MLP([50, 50]),
+      networks.PolicyValueHead(spec.actions.num_values),
+  ])
+
+
+class LockstepEnvironmentLoopTest(absltest.TestCase):
+
+  def test_runs_environments_in_lockstep(self):
+    # Episodes of different lengths, so environments are reset at different
+    # times.
+    environments = _make_environments([3, 5])
+    spec = specs.make_environment_spec(environments[0])
+    environment_adders = [_CountingAdder() for _ in environments]
+    variable_client = _CountingVariableClient()
+
+    actor = acting.BatchedMCTSActor(
+        environment_spec=spec,
+        environment_models=[
+            simulator.Simulator(environment) for environment in environments
+        ],
+        network=_make_eval_network(spec),
+        discount=1.,
+        num_simulations=10,
+        environment_adders=environment_adders,
+        variable_client=variable_client)
+    counter = counting.Counter()
+    loop = environment_loop.LockstepEnvironmentLoop(
+        environments, actor, counter=counter)
+    num_steps = loop.run(num_steps=15)
+
+    self.assertEqual(num_steps, 16)
+    self.assertEqual([adder.num_adds for adder in environment_adders], [8, 8])
+    # The actor is updated once per environment step.
+    self.assertEqual(variable_client.num_updates, 16)
+    # Both environments were reset whenever their episodes finished.
+    self.assertEqual([adder.num_episodes for adder in environment_adders],
+                     [3, 2])
+    self.assertEqual(counter.get_counts()['episodes'], 3)
+    self.assertEqual(counter.get_counts()['steps'], 11)
+
+  def test_runs_repr_actor_in_lockstep(self):
+    environments = _make_environments([4, 4, 4])
+    spec = specs.make_environment_spec(environments[0])
+    repr_network = snt.Sequential([
+        snt.Flatten(),
+        snt.nets.MLP([50, 50]),
+    ])
+    environment_adders = [_CountingAdder() for _ in environments]
+
+    actor = acting.BatchedReprMCTSActor(
+        environment_spec=spec,
+        environment_models=[
+            mlp.ReprMLPModel(
+                repr_network=repr_network,
+                environment_spec=spec,
+                replay_capacity=100,
+                batch_size=4,
+                hidden_sizes=(50,)) for _ in environments
+        ],
+        repr_network=repr_network,
+        eval_network=_make_eval_network(spec),
+        discount=1.,
+        num_simulations=10,
+        environment_adders=environment_adders)
+    loop = environment_loop.LockstepEnvironmentLoop(environments, actor)
+    self.assertEqual(loop.run(num_episodes=3), 12)
+    self.assertEqual([adder.num_adds for adder in environment_adders],
+                     [4, 4, 4])
+
+
+if __name__ == '__main__':
+  absltest.main()
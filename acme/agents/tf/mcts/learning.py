@@ -14,18 +14,178 @@
 
 """A MCTS "AlphaZero-style" learner."""
 
-from typing import List, Optional
+import contextlib
+import functools
+import time
+import weakref
+from typing import (Any, Callable, ContextManager, Dict, Iterable, Iterator,
+                    List, Optional, Tuple)
 
 import acme
+from acme.adders import reverb as adders
 from acme.tf import utils as tf2_utils
 from acme.tf import savers as tf2_savers
+from acme.utils import async_utils
 from acme.utils import counting
 from acme.utils import loggers
 import numpy as np
+import reverb
 import sonnet as snt
 import tensorflow as tf
 
 
+def _dequantize(pi: tf.Tensor) -> tf.Tensor:
+  """Recovers a (renormalized) policy from its quantized replay encoding."""
+  if pi.dtype != tf.uint8:
+    return pi
+  pi = tf.cast(pi, tf.float32)
+  return pi / tf.reduce_sum(pi, axis=-1, keepdims=True)
+
+
+def _input_signature(
+    dataset: Iterable[reverb.ReplaySample]) -> Optional[List[Any]]:
+  """Returns the train step's input signature, if `dataset` has a static one.
+
+  An `AdaptiveBatcher` changes its batch size, so it has no fixed signature;
+  the step is then retraced (and recompiled) once per batch size it reaches.
+  """
+  if isinstance(dataset, tf.data.Dataset):
+    return [dataset.element_spec]
+  return None
+
+
+def _compile_step(
+    learner: acme.Learner,
+    dataset: Iterable[reverb.ReplaySample],
+) -> Callable[[reverb.ReplaySample], Dict[str, tf.Tensor]]:
+  """Returns the learner's `_step` compiled with XLA for the dataset's spec.
+
+  The compiled function only holds a weak reference to `learner`. A
+  `tf.function` of the bound method would be stored on the learner and form a
+  cycle, keeping the learner (and its dataset, networks and priority thread)
+  alive after its agent is deleted, until the cyclic garbage collector runs.
+  """
+  learner_ref = weakref.ref(learner)
+  step_fn = type(learner)._step
+
+  def step(inputs: reverb.ReplaySample) -> Dict[str, tf.Tensor]:
+    return step_fn(learner_ref(), inputs)
+
+  return tf.function(
+      step, jit_compile=True, input_signature=_input_signature(dataset))
+
+
+def _importance_weights(probs: tf.Tensor, exponent: float) -> tf.Tensor:
+  """Returns importance weights correcting for prioritized sampling."""
+  importance_weights = 1. / probs  # [B]
+  importance_weights **= exponent
+  importance_weights /= tf.reduce_max(importance_weights)
+  return tf.cast(importance_weights, tf.float32)
+
+
+def _mutate_priorities(
+    client: reverb.Client, update: Tuple[tf.Tensor, tf.Tensor]):
+  """Copies a step's (keys, priorities) to host and sends them to replay."""
+  keys, priorities = update
+  client.mutate_priorities(
+      table=adders.DEFAULT_PRIORITY_TABLE,
+      updates=dict(zip(keys.numpy(), priorities.numpy())))
+
+
+class AdaptiveBatcher:
+  """Iterates over replay batches whose size adapts to a target step latency.
+
+  The learner times each of its steps with `time_step()`. Every
+  `adjust_period` steps the batch size is doubled if the average step took less
+  than half of `target_latency_ms`, and halved if it took longer than
+  `target_latency_ms`. Sizes move in powers of two so that the learner's step
+  function is retraced at most a handful of times.
+  """
+
+  def __init__(
+      self,
+      dataset: tf.data.Dataset,
+      batch_size: int,
+      min_batch_size: int,
+      max_batch_size: int,
+      target_latency_ms: float,
+      adjust_period: int = 100,
+      transform: Optional[Callable[[tf.data.Dataset], tf.data.Dataset]] = None,
+      clock: Callable[[], float] = time.perf_counter,
+  ):
+    """Creates an adaptive batcher.
+
+    Args:
+      dataset: an unbatched dataset of replay samples.
+      batch_size: the initial batch size.
+      min_batch_size: the smallest batch size to shrink to.
+      max_batch_size: the largest batch size to grow to.
+      target_latency_ms: the target wall time of a learner step.
+      adjust_period: the number of steps to average over before adjusting.
+      transform: an optional transformation applied to the batched dataset,
+        e.g. prefetching.
+      clock: returns the current time in seconds.
+    """
+    self._dataset = dataset
+    self._min_batch_size = min_batch_size
+    self._max_batch_size = max_batch_size
+    self._target_latency_ms = target_latency_ms
+    self._adjust_period = adjust_period
+    self._transform = transform
+    self._clock = clock
+    self._rebuild(batch_size)
+
+  @property
+  def batch_size(self) -> int:
+    return self._batch_size
+
+  def _rebuild(self, batch_size: int):
+    dataset = self._dataset.batch(batch_size, drop_remainder=True)
+    if self._transform:
+      dataset = self._transform(dataset)
+    self._batch_size = batch_size
+    self._iterator = iter(dataset)
+    self._latencies = []
+    # The first step with a new batch size retraces the learner; ignore it.
+    self._num_warmup_steps = 1
+
+  def _maybe_adjust(self):
+    latency_ms = 1000 * np.mean(self._latencies)
+    self._latencies = []
+    if (latency_ms < self._target_latency_ms / 2 and
+        2 * self._batch_size <= self._max_batch_size):
+      self._rebuild(2 * self._batch_size)
+    elif (latency_ms > self._target_latency_ms and
+          self._batch_size // 2 >= self._min_batch_size):
+      self._rebuild(self._batch_size // 2)
+
+  @contextlib.contextmanager
+  def time_step(self) -> Iterator[None]:
+    """Times one learner step, which must finish before the context exits."""
+    start = self._clock()
+    yield
+    latency = self._clock() - start
+    if self._num_warmup_steps:
+      self._num_warmup_steps -= 1
+      return
+    self._latencies.append(latency)
+    if len(self._latencies) >= self._adjust_period:
+      self._maybe_adjust()
+
+  def __iter__(self) -> 'AdaptiveBatcher':
+    return self
+
+  def __next__(self) -> reverb.ReplaySample:
+    return next(self._iterator)
+
+
+def _time_step(iterator: Iterator[reverb.ReplaySample]) -> ContextManager[None]:
+  """Times a learner step if the batch size adapts to the step latency."""
+  if isinstance(iterator, AdaptiveBatcher):
+    return iterator.time_step()
+  return contextlib.nullcontext()
+
+
 class AZLearner(acme.Learner):
   """AlphaZero-style learning."""
 
@@ -33,10 +193,12 @@ class AZLearner(acme.Learner):
       self,
       network: snt.Module,
       optimizer: snt.Optimizer,
-      dataset: tf.data.Dataset,
+      dataset: Iterable[reverb.ReplaySample],
       discount: float,
       logger: Optional[loggers.Logger] = None,
       counter: Optional[counting.Counter] = None,
+      replay_client: Optional[reverb.Client] = None,
+      importance_sampling_exponent: float = 0.2,
   ):
 
     # Logger and counter for tracking statistics / writing out to terminal.
@@ -50,14 +212,24 @@ class AZLearner(acme.Learner):
     self._network = network
     self._variables = network.trainable_variables
     self._discount = np.float32(discount)
+    self._importance_sampling_exponent = importance_sampling_exponent
 
-  @tf.function
-  def _step(self) -> tf.Tensor:
-    """Do a step of SGD on the loss."""
+    # Priorities are sent from a background thread, if replay is given, so
+    # the learner waits on neither the host copy nor the RPC.
+    self._priority_updater = None
+    if replay_client:
+      self._priority_updater = async_utils.BackgroundDispatcher(
+          functools.partial(_mutate_priorities, replay_client))
+
+    # Compile the train step with XLA, once for the dataset's batch spec.
+    self._step = _compile_step(self, dataset)
+
+  def _step(self, inputs: reverb.ReplaySample) -> Dict[str, tf.Tensor]:
+    """Do a step of SGD on the loss and compute new priorities."""
 
-    inputs = next(self._iterator)
     o_t, _, r_t, d_t, o_tp1, extras = inputs.data
-    pi_t = extras['pi']
+    keys, probs = inputs.info[:2]
+    pi_t = _dequantize(extras['pi'])
 
     with tf.GradientTape() as tape:
       # Forward the network on the two states in the transition.
@@ -66,24 +238,39 @@ class AZLearner(acme.Learner):
       target_value = tf.stop_gradient(target_value)
 
       # Value loss is simply on-policy TD learning.
-      value_loss = tf.square(r_t + self._discount * d_t * target_value - value)
+      td_error = r_t + self._discount * d_t * target_value - value
+      value_loss = tf.square(td_error)
 
       # Policy loss distills MCTS policy into the policy network.
       policy_loss = tf.nn.softmax_cross_entropy_with_logits(
           logits=logits, labels=pi_t)
 
-      # Compute gradients.
-      loss = tf.reduce_mean(value_loss + policy_loss)
+      # Reweight to correct for prioritized sampling, and compute gradients.
+      importance_weights = _importance_weights(
+          probs, self._importance_sampling_exponent)
+      loss = tf.reduce_mean(importance_weights * (value_loss + policy_loss))
       gradients = tape.gradient(loss, self._network.trainable_variables)
       
     self._optimizer.apply(gradients, self._network.trainable_variables)
 
-    return loss
+    return {
+        'loss': loss,
+        'keys': keys,
+        'priorities': tf.abs(td_error),
+    }
 
   def step(self):
-    """Does a step of SGD and logs the results."""
-    loss = self._step()
-    self._logger.write({'loss': loss})
+    """Does a step of SGD, updates priorities and logs the results."""
+    inputs = next(self._iterator)
+    with _time_step(self._iterator):
+      result = self._step(inputs)
+      # Copying the loss to host waits for the step, so it is timed in full.
+      result['loss'] = result['loss'].numpy()
+    keys = result.pop('keys')
+    priorities = result.pop('priorities')
+    if self._priority_updater:
+      self._priority_updater.put((keys, priorities))
+    self._logger.write(result)
 
   def get_variables(self, names: List[str]) -> List[List[np.ndarray]]:
     """Exposes the variables for actors to update from."""
@@ -98,10 +285,12 @@ class MZLearner(acme.Learner):
       repr_network: snt.Module,
       eval_network: snt.Module,
       optimizer: snt.Optimizer,
-      dataset: tf.data.Dataset,
+      dataset: Iterable[reverb.ReplaySample],
       discount: float,
       logger: Optional[loggers.Logger] = None,
       counter: Optional[counting.Counter] = None,
+      replay_client: Optional[reverb.Client] = None,
+      importance_sampling_exponent: float = 0.2,
       checkpoint: bool = True,
       save_directory: str = '~/acme',
   ):
@@ -119,6 +308,17 @@ class MZLearner(acme.Learner):
     self._repr_variables = repr_network.trainable_variables
     self._eval_variables = eval_network.trainable_variables
     self._discount = np.float32(discount)
+    self._importance_sampling_exponent = importance_sampling_exponent
+
+    # Priorities are sent from a background thread, if replay is given, so
+    # the learner waits on neither the host copy nor the RPC.
+    self._priority_updater = None
+    if replay_client:
+      self._priority_updater = async_utils.BackgroundDispatcher(
+          functools.partial(_mutate_priorities, replay_client))
+
+    # Compile the train step with XLA, once for the dataset's batch spec.
+    self._step = _compile_step(self, dataset)
 
     self._checkpointer = None 
     self._snapshotter = None 
@@ -137,42 +337,56 @@ class MZLearner(acme.Learner):
           objects_to_save={'repr_network': repr_network, 'eval_network': eval_network}
       )
 
-  @tf.function
-  def _step(self) -> tf.Tensor:
-    """Do a step of SGD on the loss."""
+  def _step(self, inputs: reverb.ReplaySample) -> Dict[str, tf.Tensor]:
+    """Do a step of SGD on the loss and compute new priorities."""
 
-    inputs = next(self._iterator)
     o_t, _, r_t, d_t, o_tp1, extras = inputs.data
-    pi_t = extras['pi']
+    keys, probs = inputs.info[:2]
+    pi_t = _dequantize(extras['pi'])
 
     with tf.GradientTape() as tape:
-      # representation
-      h_t = self._repr_network(o_t)
-      h_tp1 = self._repr_network(o_tp1)
-      # Forward the network on the two states in the transition.
-      logits, value = self._eval_network(h_t)
-      _, target_value = self._eval_network(h_tp1)
+      # Forward the representation and evaluation networks on the two states
+      # in the transition as a single batch, then split the outputs.
+      h = self._repr_network(tf.concat([o_t, o_tp1], axis=0))
+      logits, value = self._eval_network(h)
+      logits, _ = tf.split(logits, 2, axis=0)
+      value, target_value = tf.split(value, 2, axis=0)
       target_value = tf.stop_gradient(target_value)
 
       # Value loss is simply on-policy TD learning.
-      value_loss = tf.square(r_t + self._discount * d_t * target_value - value)
+      td_error = r_t + self._discount * d_t * target_value - value
+      value_loss = tf.square(td_error)
 
       # Policy loss distills MCTS policy into the policy network.
       policy_loss = tf.nn.softmax_cross_entropy_with_logits(
           logits=logits, labels=pi_t)
 
-      # Compute gradients.
-      loss = tf.reduce_mean(value_loss + policy_loss)
+      # Reweight to correct for prioritized sampling, and compute gradients.
+      importance_weights = _importance_weights(
+          probs, self._importance_sampling_exponent)
+      loss = tf.reduce_mean(importance_weights * (value_loss + policy_loss))
       gradients = tape.gradient(loss, self._eval_network.trainable_variables + self._repr_network.trainable_variables)
       
     self._optimizer.apply(gradients, self._eval_network.trainable_variables + self._repr_network.trainable_variables)
 
-    return loss
+    return {
+        'loss': loss,
+        'keys': keys,
+        'priorities': tf.abs(td_error),
+    }
 
   def step(self):
-    """Does a step of SGD and logs the results."""
-    loss = self._step()
-    self._logger.write({'loss': loss})
+    """Does a step of SGD, updates priorities and logs the results."""
+    inputs = next(self._iterator)
+    with _time_step(self._iterator):
+      result = self._step(inputs)
+      # Copying the loss to host waits for the step, so it is timed in full.
+      result['loss'] = result['loss'].numpy()
+    keys = result.pop('keys')
+    priorities = result.pop('priorities')
+    if self._priority_updater:
+      self._priority_updater.put((keys, priorities))
+    self._logger.write(result)
     if self._checkpointer: self._checkpointer.save()
     if self._snapshotter: self._snapshotter.save()
 
@@ -0,0 +1,234 @@
+# Copyright 2018 DeepMind Technologies Limited. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for learning.py."""
+
+import itertools
+
+from acme import datasets
+from acme import specs
+from acme.adders import reverb as adders
+from acme.agents.tf.mcts import acting
+from acme.agents.tf.mcts import learning
+from acme.testing import fakes
+from acme.tf import networks
+from acme.tf import utils as tf2_utils
+from acme.utils import loggers
+import dm_env
+import numpy as np
+import reverb
+import sonnet as snt
+import tensorflow as tf
+
+from absl.testing import absltest
+
+
+class _FakeClock:
+
+  def __init__(self):
+    self.now = 0.
+
+  def __call__(self) -> float:
+    return self.now
+
+
+class QuantizationTest(absltest.TestCase):
+
+  def _round_trip(self, probs: np.ndarray) -> np.ndarray:
+    quantized = acting._quantize(probs)
+    self.assertEqual(quantized.dtype, np.uint8)
+    return learning._dequantize(tf.constant(quantized)).numpy()
+
+  def test_round_trip(self):
+    probs = np.array([0.1, 0.2, 0.3, 0.4], dtype=np.float32)
+    np.testing.assert_allclose(self._round_trip(probs), probs, atol=1e-3)
+
+  def test_round_trip_factored(self):
+    probs = np.array([[0.5, 0.5, 0.], [0.7, 0.2, 0.1]], dtype=np.float32)
+    pi = self._round_trip(probs)
+    np.testing.assert_allclose(pi.sum(axis=-1), 1., rtol=1e-6)
+    np.testing.assert_allclose(pi, probs, atol=3e-3)
+
+  def test_flat_policy_over_many_actions(self):
+    # Each probability is below half a 1/255 step; the row must not collapse.
+    num_actions = 600
+    probs = np.ones(num_actions, dtype=np.float32) / num_actions
+    np.testing.assert_allclose(self._round_trip(probs), probs, rtol=1e-5)
+
+  def test_float_policies_pass_through(self):
+    probs = np.array([0.25, 0.75], dtype=np.float32)
+    np.testing.assert_array_equal(
+        learning._dequantize(tf.constant(probs)).numpy(), probs)
+
+
+class AdaptiveBatcherTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self._clock = _FakeClock()
+    self._batcher = learning.AdaptiveBatcher(
+        tf.data.Dataset.range(1_000_000),
+        batch_size=8,
+        min_batch_size=2,
+        max_batch_size=32,
+        target_latency_ms=10.,
+        adjust_period=4,
+        clock=self._clock)
+
+  def _run_steps(self, num_steps: int, latency_ms: float):
+    for _ in range(num_steps):
+      batch = next(self._batcher)
+      self.assertLen(batch, self._batcher.batch_size)
+      with self._batcher.time_step():
+        self._clock.now += latency_ms / 1000
+
+  def test_doubles_when_fast(self):
+    # One warm-up step is ignored after each rebuild.
+    self._run_steps(4, latency_ms=1.)
+    self.assertEqual(self._batcher.batch_size, 8)
+    self._run_steps(1, latency_ms=1.)
+    self.assertEqual(self._batcher.batch_size, 16)
+    self._run_steps(5, latency_ms=1.)
+    self.assertEqual(self._batcher.batch_size, 32)
+    # Stays within the maximum.
+    self._run_steps(5, latency_ms=1.)
+    self.assertEqual(self._batcher.batch_size, 32)
+
+  def test_halves_when_slow(self):
+    self._run_steps(5, latency_ms=50.)
+    self.assertEqual(self._batcher.batch_size, 4)
+    self._run_steps(5, latency_ms=50.)
+    self.assertEqual(self._batcher.batch_size, 2)
+    # Stays within the minimum.
+    self._run_steps(5, latency_ms=50.)
+    self.assertEqual(self._batcher.batch_size, 2)
+
+  def test_keeps_size_near_target(self):
+    self._run_steps(10, latency_ms=7.)
+    self.assertEqual(self._batcher.batch_size, 8)
+
+  def test_only_times_the_step(self):
+    # Time spent outside `time_step`, e.g. acting, is not counted.
+    for _ in range(5):
+      next(self._batcher)
+      self._clock.now += 1.
+      with self._batcher.time_step():
+        self._clock.now += 0.001
+    self.assertEqual(self._batcher.batch_size, 16)
+
+
+class _RecordingIterator:
+
+  def __init__(self, iterator):
+    self._iterator = iterator
+    self.samples = []
+
+  def __next__(self):
+    self.samples.append(next(self._iterator))
+    return self.samples[-1]
+
+
+class PriorityUpdateTest(absltest.TestCase):
+
+  def test_step_sets_priorities_to_td_errors(self):
+    num_items, batch_size, exponent = 8, 4, 0.5
+    environment = fakes.DiscreteEnvironment(
+        num_actions=3,
+        num_observations=10,
+        obs_shape=(10,),
+        obs_dtype=np.float32)
+    spec = specs.make_environment_spec(environment)
+    extra_spec = {'pi': specs.Array((3,), np.uint8)}
+    server = reverb.Server([
+        reverb.Table(
+            name=adders.DEFAULT_PRIORITY_TABLE,
+            sampler=reverb.selectors.Prioritized(1.),
+            remover=reverb.selectors.Fifo(),
+            max_size=num_items,
+            rate_limiter=reverb.rate_limiters.MinSize(num_items),
+            signature=adders.NStepTransitionAdder.signature(spec, extra_spec))
+    ])
+    self.addCleanup(server.stop)
+    client = reverb.Client(f'localhost:{server.port}')
+
+    # Write transitions with distinct priorities, so that sampling
+    # probabilities (and importance weights) differ within a batch.
+    priorities = itertools.count(1.)
+    adder = adders.NStepTransitionAdder(
+        client=client,
+        n_step=1,
+        discount=1.,
+        priority_fns={
+            adders.DEFAULT_PRIORITY_TABLE: lambda _: next(priorities)
+        })
+    observations = np.random.RandomState(0).rand(num_items + 1, 10)
+    observations = observations.astype(np.float32)
+    pi = acting._quantize(np.ones(3, dtype=np.float32) / 3)
+    adder.add_first(dm_env.restart(observations[0]))
+    for observation in observations[1:]:
+      timestep = dm_env.transition(
+          np.float32(1.), observation, discount=np.float32(1.))
+      adder.add(np.int32(0), timestep, extras={'pi': pi})
+    adder.reset()
+
+    network = snt.Sequential([
+        snt.nets.MLP([16]),
+        networks.PolicyValueHead(spec.actions.num_values),
+    ])
+    tf2_utils.create_variables(network, [spec.observations])
+    logger = loggers.InMemoryLogger()
+    # A zero learning rate keeps the network as it was when the batch was
+    # scored, so that the expected TD errors can be recomputed.
+    learner = learning.AZLearner(
+        network=network,
+        optimizer=snt.optimizers.SGD(0.),
+        dataset=datasets.make_reverb_dataset(
+            server_address=f'localhost:{server.port}',
+            batch_size=batch_size),
+        discount=0.,
+        logger=logger,
+        replay_client=client,
+        importance_sampling_exponent=exponent)
+    learner._iterator = _RecordingIterator(learner._iterator)
+    learner.step()
+    learner._priority_updater.flush()
+
+    sample, = learner._iterator.samples
+    o_t, _, r_t, _, _, _ = sample.data
+    logits, value = network(o_t)
+    td_errors = np.abs(r_t.numpy() - value.numpy())
+    expected = dict(zip(sample.info.key.numpy(), td_errors))
+
+    # The loss is reweighted by the (normalized) importance weights.
+    weights = (1. / sample.info.probability.numpy()) ** exponent
+    weights /= weights.max()
+    self.assertGreater(weights.max() - weights.min(), 1e-3)
+    policy_loss = tf.nn.softmax_cross_entropy_with_logits(
+        logits=logits, labels=tf.ones([batch_size, 3]) / 3).numpy()
+    np.testing.assert_allclose(
+        logger.data[0]['loss'],
+        np.mean(weights * (td_errors**2 + policy_loss)),
+        rtol=1e-5)
+
+    # Every sampled key now has its |TD error| as its priority.
+    stored = {}
+    for sample in client.sample(
+        adders.DEFAULT_PRIORITY_TABLE, 1000, emit_timesteps=False):
+      stored[sample.info.key] = sample.info.priority
+    for key, td_error in expected.items():
+      self.assertAlmostEqual(stored[key], td_error, places=5)
+
+
+if __name__ == '__main__':
+  absltest.main()
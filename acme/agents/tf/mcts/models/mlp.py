@@ -73,8 +73,19 @@ class MLPTransitionModel(snt.Module):
     return next_state, reward, discount_logits
 
 
+def _to_tensor(x: types.Observation) -> tf.Tensor:
+  """Returns `x` as a tensor, copying it first if it is a (mutable) array."""
+  if isinstance(x, tf.Tensor):
+    return x
+  return tf.convert_to_tensor(np.array(x))
+
+
 class MLPModel(base.Model):
-  """A simple environment model."""
+  """A simple environment model.
+
+  The model state is kept as a tensor, so that it stays on the device of the
+  transition model and networks between search steps.
+  """
 
   _checkpoint: types.Observation
   _state: types.Observation
@@ -98,7 +109,6 @@ class MLPModel(base.Model):
     self._replay = replay.Replay(replay_capacity)
     self._transition_model = MLPTransitionModel(environment_spec, hidden_sizes)
     self._optimizer = snt.optimizers.Adam(learning_rate)
-    self._forward = tf.function(self._transition_model)
     tf2_utils.create_variables(
         self._transition_model, [self._obs_spec, self._action_spec])
     self._variables = self._transition_model.trainable_variables
@@ -106,6 +116,15 @@ class MLPModel(base.Model):
     # Model state.
     self._needs_reset = True
 
+  @tf.function
+  def _predict(self, state: tf.Tensor,
+               action: tf.Tensor) -> Tuple[tf.Tensor, tf.Tensor]:
+    """Predicts the next state and the [reward, discount logit] of one step."""
+    state, action = tf2_utils.add_batch_dim([state, action])
+    next_state, reward, discount_logits = self._transition_model(state, action)
+    scalars = tf.stack([reward, discount_logits], axis=-1)
+    return tf2_utils.squeeze_batch_dim((next_state, scalars))
+
   @tf.function
   def _step(
       self,
@@ -139,28 +158,24 @@ class MLPModel(base.Model):
     if self._needs_reset:
       raise ValueError('Model must be reset with an initial timestep.')
 
-    # Step the model.
-    state, action = tf2_utils.add_batch_dim([self._state, action])
-    new_state, reward, discount_logits = [
-        x.numpy().squeeze(axis=0) for x in self._forward(state, action)
-    ]
+    # Step the model in a single graph call. The resulting state is kept as a
+    # tensor for the next step; only the reward and discount are copied out.
+    self._state, scalars = self._predict(self._state, tf.constant(action))
+    reward, discount_logits = scalars.numpy()
     discount = special.softmax(discount_logits)
 
-    # Save the resulting state for the next step.
-    self._state = new_state
-
     # We threshold discount on a given tolerance.
     if discount < self._terminal_tol:
       self._needs_reset = True
-      return dm_env.termination(reward=reward, observation=self._state.copy())
-    return dm_env.transition(reward=reward, observation=self._state.copy())
+      return dm_env.termination(reward=reward, observation=self._state)
+    return dm_env.transition(reward=reward, observation=self._state)
 
   def reset(self, initial_state: Optional[types.Observation] = None):
     if initial_state is None:
       raise ValueError('Model must be reset with an initial state.')
     # We reset to an initial state that we are explicitly given.
     # This allows us to handle environments with stochastic resets (e.g. Catch).
-    self._state = initial_state.copy()
+    self._state = _to_tensor(initial_state)
     self._needs_reset = False
     return dm_env.restart(self._state)
 
@@ -184,7 +199,7 @@ class MLPModel(base.Model):
     ts = self.step(action)
 
     # Copy the *true* state on update.
-    self._state = next_timestep.observation.copy()
+    self._state = _to_tensor(next_timestep.observation)
 
     if ts.last() or next_timestep.last():
       # Model believes that a termination has happened.
@@ -202,11 +217,11 @@ class MLPModel(base.Model):
   def save_checkpoint(self):
     if self._needs_reset:
       raise ValueError('Cannot save checkpoint: model must be reset first.')
-    self._checkpoint = self._state.copy()
+    self._checkpoint = self._state
 
   def load_checkpoint(self):
     self._needs_reset = False
-    self._state = self._checkpoint.copy()
+    self._state = self._checkpoint
 
   def action_spec(self):
     return self._action_spec
@@ -287,7 +302,6 @@ class ReprMLPModel(MLPModel):
     self._replay = replay.Replay(replay_capacity)
     self._transition_model = ReprMLPTransitionModel(repr_output_spec, environment_spec, hidden_sizes)
     self._optimizer = snt.optimizers.Adam(learning_rate)
-    self._forward = tf.function(self._transition_model)
     tf2_utils.create_variables(
         self._transition_model, [repr_output_spec, self._action_spec])
     self._variables = self._transition_model.trainable_variables + repr_network.trainable_variables
@@ -343,7 +357,7 @@ class ReprMLPModel(MLPModel):
     ts = self.step(action)
     
     # Copy the *true* state's representation on update.
-    self._state = self._repr_network(tf.expand_dims(next_timestep.observation, axis=0)).numpy().squeeze(0).copy()
+    self._state = tf.squeeze(self._repr_network(tf.expand_dims(next_timestep.observation, axis=0)), axis=0)
 
     if ts.last() or next_timestep.last():
       # Model believes that a termination has happened.
@@ -361,6 +375,6 @@ class ReprMLPModel(MLPModel):
   def reset(self, initial_state: Optional[types.Observation] = None):
     if initial_state is None:
       raise ValueError('Model must be reset with an initial state.')
-    _initial_state = self._repr_network(tf.expand_dims(initial_state, axis=0)).numpy().squeeze(0)
+    _initial_state = tf.squeeze(self._repr_network(tf.expand_dims(initial_state, axis=0)), axis=0)
     
     return super().reset(_initial_state)
\ No newline at end of file
@@ -15,10 +15,13 @@
 """A Monte Carlo Tree Search implementation."""
 
 import dataclasses
-from typing import Callable, Dict, Tuple, List
+import functools
+from typing import (Callable, Dict, Iterable, List, Optional, Sequence, Tuple,
+                    Union)
 
 from acme.agents.tf.mcts import models
 from acme.agents.tf.mcts import types
+import dm_env
 import numpy as np
 
 
@@ -133,9 +136,93 @@ class SubNode:
     return 0.
   
 
+class Tree:
+  """A MCTS search tree stored as flat, preallocated (struct-of-arrays) tables.
+
+  Nodes are integer ids into the tables below, with the root at `ROOT`. Edge
+  statistics N(s, a), W(s, a) and P(s, a) are `[max_nodes, num_actions]` arrays,
+  so a node's children are scored with a single vectorized expression. Child
+  nodes are only allocated when first visited; as each simulation allocates at
+  most one node, a search with `num_simulations` needs `num_simulations + 1`.
+  """
+
+  ROOT = 0
+
+  def __init__(self, max_nodes: int, num_actions: int):
+    self.max_nodes = max_nodes
+    self.num_actions = num_actions
+
+    # Edge statistics, indexed by [node, action].
+    self.prior = np.zeros((max_nodes, num_actions), dtype=np.float64)
+    self.visit_count = np.zeros((max_nodes, num_actions), dtype=np.int32)
+    self.total_value = np.zeros((max_nodes, num_actions), dtype=np.float64)
+    self.children = np.full((max_nodes, num_actions), -1, dtype=np.int32)
+
+    # Node statistics, indexed by [node].
+    self.node_visit_count = np.zeros(max_nodes, dtype=np.int32)
+    self.reward = np.zeros(max_nodes, dtype=np.float64)
+    self.terminal = np.zeros(max_nodes, dtype=bool)
+    self.expanded = np.zeros(max_nodes, dtype=bool)
+    self.num_nodes = 0
+
+    # Scratch buffers holding the (node, action) edges of one simulation; a
+    # path visits each node at most once, so it has fewer than `max_nodes`.
+    self.path_nodes = np.zeros(max_nodes, dtype=np.int32)
+    self.path_actions = np.zeros(max_nodes, dtype=np.int32)
+
+  def reset(self):
+    """Clears the tree in place, leaving only an unexpanded root."""
+    self.prior.fill(0.)
+    self.visit_count.fill(0)
+    self.total_value.fill(0.)
+    self.children.fill(-1)
+    self.node_visit_count.fill(0)
+    self.reward.fill(0.)
+    self.terminal.fill(False)
+    self.expanded.fill(False)
+    self.num_nodes = 1
+
+  def expand(self, node: int, prior: np.ndarray):
+    """Expands a node, setting the prior of each of its children."""
+    assert prior.shape == (self.num_actions,)  # Prior should be a flat vector.
+    self.prior[node] = prior
+    self.expanded[node] = True
+
+  def child(self, node: int, action: types.Action) -> int:
+    """Returns the child of `node` along `action`, allocating it if needed."""
+    child = self.children[node, action]
+    if child < 0:
+      if self.num_nodes >= self.max_nodes:
+        raise ValueError(
+            f'Search tree is full; it was allocated {self.max_nodes} nodes.')
+      child = self.num_nodes
+      self.children[node, action] = child
+      self.num_nodes += 1
+    return child
+
+  def values(self, node: int) -> np.ndarray:
+    """Returns the action values Q(s, a) of a node's children."""
+    visits = self.visit_count[node]
+    return np.where(
+        visits > 0, self.total_value[node] / np.maximum(visits, 1), 0.)
+
+  @property
+  def children_visits(self) -> np.ndarray:
+    """Return array of visit counts of the root's children."""
+    return self.visit_count[self.ROOT].copy()
+
+  @property
+  def children_values(self) -> np.ndarray:
+    """Return array of values of the root's children."""
+    return self.values(self.ROOT)
+
+
 SearchPolicy = Callable[[Node], types.Action]
+TreeSearchPolicy = Callable[[Tree, int], types.Action]
 FactoredSearchPolicy = Callable[[SampledNode, int], types.Action]
 SamplePolicy = Callable[[types.Probs], Tuple[types.Action, types.Probs]]
+SearchFn = Callable[..., Tree]
+BatchedSearchFn = Callable[..., Sequence[Tree]]
 
 
 def mcts(
@@ -219,6 +306,281 @@ def mcts(
   return root
 
 
+def _reset_root(
+    tree: Tree,
+    prior: types.Probs,
+    dirichlet_alpha: float,
+    exploration_fraction: float,
+):
+  """Clears `tree` and expands its root with the (noised) prior."""
+  num_actions = tree.num_actions
+  assert prior.shape == (num_actions,)
+
+  # Add exploration noise to the prior.
+  noise = np.random.dirichlet(alpha=[dirichlet_alpha] * num_actions)
+  prior = prior * (1 - exploration_fraction) + noise * exploration_fraction
+
+  # Clear the tree search.
+  tree.reset()
+  tree.expand(tree.ROOT, prior)
+
+
+def _descend(
+    tree: Tree,
+    model: models.Model,
+    search_policy: TreeSearchPolicy,
+) -> Tuple[int, int, dm_env.TimeStep]:
+  """Runs the selection phase of one simulation, stepping `model` along it.
+
+  The (node, action) edges taken are written to the tree's path buffers.
+
+  Returns:
+    The leaf node reached, the depth of the path, and the last timestep.
+  """
+  # Start a new simulation from the top.
+  depth = 0
+  node = tree.ROOT
+
+  # Generate a trajectory of (node, action) edges into the path buffers.
+  timestep = None
+  while tree.expanded[node]:
+    # Select an action according to the search policy.
+    action = search_policy(tree, node)
+    tree.path_nodes[depth] = node
+    tree.path_actions[depth] = action
+    depth += 1
+
+    # Point the node at the corresponding child.
+    node = tree.child(node, action)
+
+    # Step the simulator and add this timestep to the node.
+    timestep = model.step(action)
+    tree.reward[node] = timestep.reward or 0.
+    tree.terminal[node] = timestep.last()
+
+  if timestep is None:
+    raise ValueError('Generated an empty rollout; this should not happen.')
+  return node, depth, timestep
+
+
+def _backup(tree: Tree, depth: int, value: types.Value, discount: float):
+  """Backs up a leaf value along the tree's current path of `depth` edges."""
+  # Monte Carlo back-up with bootstrap from value function.
+  ret = value
+  for i in reversed(range(depth)):
+    # Walk back up the trajectory, from the latest edge.
+    parent, action = tree.path_nodes[i], tree.path_actions[i]
+    node = tree.children[parent, action]
+
+    # Accumulate the discounted return
+    ret *= discount
+    ret += tree.reward[node]
+
+    # Update the edge and the node it points to.
+    tree.total_value[parent, action] += ret
+    tree.visit_count[parent, action] += 1
+    tree.node_visit_count[node] += 1
+
+  tree.node_visit_count[tree.ROOT] += 1
+
+
+def tree_mcts(
+    observation: types.Observation,
+    model: models.Model,
+    tree: Tree,
+    search_policy: TreeSearchPolicy,
+    evaluation: types.EvaluationFn,
+    num_simulations: int,
+    discount: float = 1.,
+    dirichlet_alpha: float = 1,
+    exploration_fraction: float = 0.,
+    root_evaluation: Optional[Tuple[types.Probs, types.Value]] = None,
+) -> Tree:
+  """Does Monte Carlo tree search (MCTS) in place, on a preallocated tree.
+
+  If `root_evaluation` is given it is used as the (prior, value) of the root,
+  instead of evaluating `observation`.
+  """
+
+  # Evaluate the prior policy for this state.
+  if root_evaluation is None:
+    root_evaluation = evaluation(observation)
+  prior, _ = root_evaluation
+  _reset_root(tree, prior, dirichlet_alpha, exploration_fraction)
+
+  # Save the model state so that we can reset it for each simulation.
+  model.save_checkpoint()
+  for _ in range(num_simulations):
+    node, depth, timestep = _descend(tree, model, search_policy)
+
+    # Calculate the bootstrap for leaf nodes.
+    if tree.terminal[node]:
+      # If terminal, there is no bootstrap value.
+      value = 0.
+    else:
+      # Otherwise, bootstrap from this node with our value function.
+      prior, value = evaluation(timestep.observation)
+
+      # We also want to expand this node for next time.
+      tree.expand(node, prior)
+
+    # Load the saved model state.
+    model.load_checkpoint()
+
+    _backup(tree, depth, value, discount)
+
+  return tree
+
+
+def batched_tree_mcts(
+    observations: Sequence[types.Observation],
+    environment_models: Sequence[models.Model],
+    trees: Sequence[Tree],
+    search_policy: TreeSearchPolicy,
+    evaluation: types.BatchEvaluationFn,
+    num_simulations: int,
+    discount: float = 1.,
+    dirichlet_alpha: float = 1,
+    exploration_fraction: float = 0.,
+    root_evaluations: Optional[Tuple[types.Probs, np.ndarray]] = None,
+) -> Sequence[Tree]:
+  """Does one MCTS per (observation, model, tree), in lockstep.
+
+  Each simulation first descends every tree, then evaluates the non-terminal
+  leaves of all of them with a single call to `evaluation`, so the cost of the
+  network forward pass is shared across the batch of searches.
+
+  If `root_evaluations` is given it is used as the stacked (priors, values) of
+  the roots, instead of evaluating `observations`.
+  """
+
+  # Evaluate the prior policies of all the roots at once.
+  if root_evaluations is None:
+    root_evaluations = evaluation(observations)
+  priors, _ = root_evaluations
+  for tree, prior in zip(trees, priors):
+    _reset_root(tree, prior, dirichlet_alpha, exploration_fraction)
+
+  # Save the model states so that we can reset them for each simulation.
+  for model in environment_models:
+    model.save_checkpoint()
+  for _ in range(num_simulations):
+    leaves = [
+        _descend(tree, model, search_policy)
+        for tree, model in zip(trees, environment_models)
+    ]
+
+    # Bootstrap all non-terminal leaves from a single batched evaluation.
+    values = np.zeros(len(trees))
+    pending = [
+        i for i, (node, _, _) in enumerate(leaves)
+        if not trees[i].terminal[node]
+    ]
+    if pending:
+      priors, pending_values = evaluation(
+          [leaves[i][2].observation for i in pending])
+      for i, prior, value in zip(pending, priors, pending_values):
+        trees[i].expand(leaves[i][0], prior)
+        values[i] = value
+
+    for i, (tree, model) in enumerate(zip(trees, environment_models)):
+      # Load the saved model state.
+      model.load_checkpoint()
+      _backup(tree, leaves[i][1], values[i], discount)
+
+  return trees
+
+
+def make_search_fn(
+    num_actions: int,
+    num_simulations: int,
+    discount: float = 1.,
+    ucb_scaling: float = 1.,
+) -> SearchFn:
+  """Returns a PUCT tree search specialized to fixed shapes and constants.
+
+  The returned function owns a `Tree` preallocated for `num_simulations` and
+  closes over the hyperparameters, so it is built once per actor and called
+  with only the per-step inputs:
+
+    tree = search_fn(observation, model, evaluation[, root_evaluation])
+
+  Args:
+    num_actions: the number of (discrete) actions.
+    num_simulations: the number of simulations per search.
+    discount: the discount used to back up returns.
+    ucb_scaling: the exploration constant of the PUCT search policy.
+  """
+  tree = Tree(max_nodes=num_simulations + 1, num_actions=num_actions)
+  search_policy = functools.partial(tree_puct, ucb_scaling=ucb_scaling)
+
+  def search_fn(
+      observation: types.Observation,
+      model: models.Model,
+      evaluation: types.EvaluationFn,
+      root_evaluation: Optional[Tuple[types.Probs, types.Value]] = None,
+  ) -> Tree:
+    return tree_mcts(
+        observation,
+        model=model,
+        tree=tree,
+        search_policy=search_policy,
+        evaluation=evaluation,
+        num_simulations=num_simulations,
+        discount=discount,
+        root_evaluation=root_evaluation,
+    )
+
+  return search_fn
+
+
+def make_batched_search_fn(
+    num_searches: int,
+    num_actions: int,
+    num_simulations: int,
+    discount: float = 1.,
+    ucb_scaling: float = 1.,
+) -> BatchedSearchFn:
+  """Returns `num_searches` PUCT tree searches run in lockstep.
+
+  Like `make_search_fn`, but the returned function owns one preallocated
+  `Tree` per search and runs `batched_tree_mcts` over all of them:
+
+    trees = search_fn(observations, models, evaluation[, root_evaluations])
+
+  Args:
+    num_searches: the number of searches (e.g. environments) in the batch.
+    num_actions: the number of (discrete) actions.
+    num_simulations: the number of simulations per search.
+    discount: the discount used to back up returns.
+    ucb_scaling: the exploration constant of the PUCT search policy.
+  """
+  trees = [
+      Tree(max_nodes=num_simulations + 1, num_actions=num_actions)
+      for _ in range(num_searches)
+  ]
+  search_policy = functools.partial(tree_puct, ucb_scaling=ucb_scaling)
+
+  def search_fn(
+      observations: Sequence[types.Observation],
+      environment_models: Sequence[models.Model],
+      evaluation: types.BatchEvaluationFn,
+      root_evaluations: Optional[Tuple[types.Probs, np.ndarray]] = None,
+  ) -> Sequence[Tree]:
+    return batched_tree_mcts(
+        observations,
+        environment_models=environment_models,
+        trees=trees,
+        search_policy=search_policy,
+        evaluation=evaluation,
+        num_simulations=num_simulations,
+        discount=discount,
+        root_evaluations=root_evaluations,
+    )
+
+  return search_fn
+
+
 def sampled_mcts(
     observation: types.Observation,
     model: models.Model,
@@ -318,48 +680,55 @@ def bfs(node: Node) -> types.Action:
   return argmax(-visit_counts)
 
 
-def puct(node: Node, ucb_scaling: float = 1.) -> types.Action:
-  """PUCT search policy, i.e. UCT with 'prior' policy."""
-  # Action values Q(s,a).
-  value_scores = np.array([child.value for child in node.children.values()])
-  check_numerics(value_scores)
+def _puct_scores(
+    values: np.ndarray,
+    priors: np.ndarray,
+    visits: np.ndarray,
+    parent_visits: int,
+    ucb_scaling: float,
+) -> np.ndarray:
+  """Computes Q + c * P * sqrt(N_parent) / (N + 1) over all children at once.
 
-  # Policy prior P(s,a).
-  priors = np.array([child.prior for child in node.children.values()])
+  Each term is checked on its own, so that a non-finite input is reported as
+  itself rather than through the combined score.
+  """
+  check_numerics(values)
   check_numerics(priors)
-
-  # Visit ratios.
-  visit_ratios = np.array([
-      np.sqrt(node.visit_count) / (child.visit_count + 1)
-      for child in node.children.values()
-  ])
+  visit_ratios = np.sqrt(parent_visits) / (visits + 1)
   check_numerics(visit_ratios)
+  return values + ucb_scaling * priors * visit_ratios
 
-  # Combine.
-  puct_scores = value_scores + ucb_scaling * priors * visit_ratios
-  return argmax(puct_scores)
 
+def _children_stats(
+    children: Iterable[Union[Node, SubNode]]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+  """Gathers (values, priors, visit counts) of children in a single pass."""
+  stats = np.array([(c.value, c.prior, c.visit_count) for c in children],
+                   dtype=np.float64)
+  return stats[:, 0], stats[:, 1], stats[:, 2]
 
-def factored_puct(node: SampledNode, dim: int, ucb_scaling: float = 1., ) -> types.Action:
+
+def puct(node: Node, ucb_scaling: float = 1.) -> types.Action:
   """PUCT search policy, i.e. UCT with 'prior' policy."""
-  # Action values Q(s,a).
-  value_scores = np.array([child.value for child in node.children[dim].values()])
-  check_numerics(value_scores)
+  values, priors, visits = _children_stats(node.children.values())
+  return argmax(
+      _puct_scores(values, priors, visits, node.visit_count, ucb_scaling))
 
-  # Policy prior P(s,a).
-  priors = np.array([child.prior for child in node.children[dim].values()])
-  check_numerics(priors)
 
-  # Visit ratios.
-  visit_ratios = np.array([
-      np.sqrt(node.visit_count) / (child.visit_count + 1)
-      for child in node.children[dim].values()
-  ])
-  check_numerics(visit_ratios)
+def tree_puct(tree: Tree, node: int, ucb_scaling: float = 1.) -> types.Action:
+  """PUCT search policy over all children of a `Tree` node at once."""
+  return argmax(
+      _puct_scores(tree.values(node), tree.prior[node], tree.visit_count[node],
+                   tree.node_visit_count[node], ucb_scaling))
+
 
-  # Combine.
-  puct_scores = value_scores + ucb_scaling * priors * visit_ratios
-  return argmax(puct_scores)
+def factored_puct(node: SampledNode, dim: int, ucb_scaling: float = 1., ) -> types.Action:
+  """PUCT search policy, i.e. UCT with 'prior' policy."""
+  # The children of each dimension are exactly its sampled actions, so no
+  # masking of unsampled actions is needed.
+  values, priors, visits = _children_stats(node.children[dim].values())
+  return argmax(
+      _puct_scores(values, priors, visits, node.visit_count, ucb_scaling))
 
 
 def visit_count_policy(root: Node, temperature: float = 1.) -> types.Probs:
@@ -14,6 +14,7 @@
 
 """Tests for search.py."""
 
+import copy
 from typing import Text
 
 from acme.agents.tf.mcts import search
@@ -60,6 +61,152 @@ class TestSearch(parameterized.TestCase):
     if env._paddle_x < env._ball_x:
       self.assertEqual(best_action, 2)
 
+  def test_tree_catch(self):
+    env = catch.Catch(rows=2, seed=1)
+    num_actions = env.action_spec().num_values
+    model = simulator.Simulator(env)
+    eval_fn = lambda _: (np.ones(num_actions) / num_actions, 0.)
+
+    timestep = env.reset()
+    model.reset()
+
+    tree = search.tree_mcts(
+        observation=timestep.observation,
+        model=model,
+        tree=search.Tree(max_nodes=101, num_actions=num_actions),
+        search_policy=search.tree_puct,
+        evaluation=eval_fn,
+        num_simulations=100)
+
+    best_action = search.argmax(tree.children_values)
+
+    if env._paddle_x > env._ball_x:
+      self.assertEqual(best_action, 0)
+    if env._paddle_x == env._ball_x:
+      self.assertEqual(best_action, 1)
+    if env._paddle_x < env._ball_x:
+      self.assertEqual(best_action, 2)
+
+  @parameterized.parameters([
+      'tree_mcts',
+      'root_evaluation',
+      'make_search_fn',
+  ])
+  def test_tree_mcts_matches_mcts(self, search_type: Text):
+    env = catch.Catch(rows=5, seed=1)
+    num_actions = env.action_spec().num_values
+    model = simulator.Simulator(env)
+    prior = np.array([0.2, 0.5, 0.3])
+    eval_fn = lambda observation: (prior, float(observation.mean()))
+
+    timestep = env.reset()
+    model.reset()
+    num_simulations = 50
+    exploration_fraction = 0. if search_type == 'make_search_fn' else 0.25
+
+    np.random.seed(0)
+    root = search.mcts(
+        observation=timestep.observation,
+        model=copy.deepcopy(model),
+        search_policy=search.puct,
+        evaluation=eval_fn,
+        num_simulations=num_simulations,
+        num_actions=num_actions,
+        discount=0.9,
+        exploration_fraction=exploration_fraction)
+
+    np.random.seed(0)
+    if search_type == 'make_search_fn':
+      search_fn = search.make_search_fn(
+          num_actions=num_actions,
+          num_simulations=num_simulations,
+          discount=0.9)
+      tree = search_fn(timestep.observation, copy.deepcopy(model), eval_fn)
+    else:
+      root_evaluation = None
+      if search_type == 'root_evaluation':
+        root_evaluation = eval_fn(timestep.observation)
+      tree = search.tree_mcts(
+          observation=timestep.observation,
+          model=copy.deepcopy(model),
+          tree=search.Tree(
+              max_nodes=num_simulations + 1, num_actions=num_actions),
+          search_policy=search.tree_puct,
+          evaluation=eval_fn,
+          num_simulations=num_simulations,
+          discount=0.9,
+          exploration_fraction=exploration_fraction,
+          root_evaluation=root_evaluation)
+
+    np.testing.assert_array_equal(tree.children_visits, root.children_visits)
+    np.testing.assert_allclose(tree.children_values, root.children_values)
+
+  def test_batched_tree_mcts_matches_tree_mcts(self):
+    envs = [catch.Catch(rows=5, seed=seed) for seed in range(3)]
+    num_actions = envs[0].action_spec().num_values
+    environment_models = [simulator.Simulator(env) for env in envs]
+    prior = np.array([0.2, 0.5, 0.3])
+    eval_fn = lambda observation: (prior, float(observation.mean()))
+    num_calls = []
+
+    def batch_eval_fn(observations):
+      num_calls.append(len(observations))
+      priors, values = zip(*map(eval_fn, observations))
+      return np.stack(priors), np.array(values)
+
+    # Take a few steps so that the environments are in different states.
+    observations = []
+    for model, env in zip(environment_models, envs):
+      timestep = env.reset()
+      model.reset()
+      for action in range(env.action_spec().num_values - 1):
+        timestep = env.step(action)
+        model.update(None, action, timestep)
+      observations.append(timestep.observation)
+    num_simulations = 30
+
+    search_fn = search.make_batched_search_fn(
+        num_searches=len(envs),
+        num_actions=num_actions,
+        num_simulations=num_simulations,
+        discount=0.9)
+    trees = search_fn(observations, copy.deepcopy(environment_models),
+                      batch_eval_fn)
+
+    # One batched call for the roots and at most one per simulation.
+    self.assertLessEqual(len(num_calls), num_simulations + 1)
+    self.assertEqual(num_calls[0], len(envs))
+
+    for observation, model, tree in zip(observations, environment_models,
+                                        trees):
+      expected = search.tree_mcts(
+          observation=observation,
+          model=copy.deepcopy(model),
+          tree=search.Tree(
+              max_nodes=num_simulations + 1, num_actions=num_actions),
+          search_policy=search.tree_puct,
+          evaluation=eval_fn,
+          num_simulations=num_simulations,
+          discount=0.9)
+      self.assertEqual(tree.children_visits.sum(), num_simulations)
+      np.testing.assert_array_equal(tree.children_visits,
+                                    expected.children_visits)
+      np.testing.assert_allclose(tree.children_values,
+                                 expected.children_values)
+
+  def test_puct_rejects_non_finite_priors(self):
+    prior = np.array([0.5, np.nan, 0.5])
+    node = search.Node()
+    node.expand(prior)
+    tree = search.Tree(max_nodes=2, num_actions=3)
+    tree.expand(tree.ROOT, prior)
+
+    # The message reports the priors themselves, not the combined score.
+    with self.assertRaisesRegex(ValueError, r'\[0\.5\s+nan\s+0\.5\]'):
+      search.puct(node)
+    with self.assertRaisesRegex(ValueError, r'\[0\.5\s+nan\s+0\.5\]'):
+      search.tree_puct(tree, tree.ROOT)
+
   def test_sampled_catch(self):
     env = catch.Catch(rows=2, seed=1)
     num_actions = env.action_spec().num_values
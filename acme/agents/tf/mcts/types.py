@@ -14,7 +14,7 @@
 
 """Type aliases and assumptions that are specific to the MCTS agent."""
 
-from typing import Callable, Tuple, Union, List
+from typing import Callable, List, Sequence, Tuple, Union
 import numpy as np
 
 # pylint: disable=invalid-name
@@ -32,12 +32,20 @@ Discount = Union[float, np.float32, np.float64]
 # Notation: policy logits/probabilities are simply a vector of floats.
 Probs = np.ndarray
 
+# Assumption: policies are stored in replay quantized to uint8, scaled so that
+# the most likely action of each distribution is PROBS_QUANTIZATION_SCALE.
+PROBS_QUANTIZATION_SCALE = 255
+
 # Notation: the value function is scalar-valued.
 Value = float
 
 # Notation: the 'evaluation function' maps observations -> (probs, value).
 EvaluationFn = Callable[[Observation], Tuple[Probs, Value]]
 
+# Notation: the batched evaluation function maps a sequence of observations ->
+# (stacked probs [B, A], values [B]).
+BatchEvaluationFn = Callable[[Sequence[Observation]], Tuple[Probs, np.ndarray]]
+
 # Notation: dimensions are scalar and discrete (integral).
 Dim = Union[int, np.int32, np.int64]
 
@@ -12,11 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-"""Utilities to use within loggers."""
+"""Utilities for running blocking work on background threads."""
 
 import queue
 import threading
-from typing import Callable, TypeVar, Generic
+from typing import Callable, Generic, List, TypeVar
 
 from absl import logging
 
@@ -111,3 +111,80 @@ class AsyncExecutor(Generic[E]):
       # If `should_stop` has been set, then raises if any has been raised on
       # the background thread.
       self._raise_on_error()
+
+
+# Queued by `BackgroundDispatcher.close` to stop its worker.
+_STOP = object()
+
+
+class BackgroundDispatcher(Generic[E]):
+  """Applies a function to queued items, in order, on one background thread.
+
+  Unlike `AsyncExecutor`, `flush` and `close` wait until every queued item has
+  been applied, and later items are still applied after `fn` raises. Errors are
+  re-raised on the caller's next `put`, `flush` or `close`. The bounded queue
+  blocks `put` when the worker falls behind.
+  """
+
+  def __init__(self, fn: Callable[[E], None], queue_size: int = 16):
+    self._items = queue.Queue(maxsize=queue_size)
+    self._errors = []
+    self._stopped = threading.Event()
+    # The worker must not reference `self`, so that a dispatcher that is
+    # dropped without being closed can still be garbage collected.
+    self._thread = threading.Thread(
+        target=_dispatch,
+        args=(fn, self._items, self._errors, self._stopped),
+        daemon=True)
+    self._thread.start()
+
+  def __del__(self):
+    # Never block garbage collection on a full queue; the worker also exits
+    # once it has drained the queue after `_stopped` is set.
+    self._stopped.set()
+    try:
+      self._items.put_nowait(_STOP)
+    except queue.Full:
+      pass
+
+  def _raise_on_error(self) -> None:
+    if self._errors:
+      raise self._errors.pop()
+
+  def put(self, element: E) -> None:
+    """Queues `element` for `fn(element)` on the background thread."""
+    self._raise_on_error()
+    self._items.put(element)
+
+  def flush(self) -> None:
+    """Blocks until all queued elements have been applied."""
+    self._items.join()
+    self._raise_on_error()
+
+  def close(self) -> None:
+    """Applies all queued elements, then stops and joins the worker."""
+    self._stopped.set()
+    if self._thread.is_alive():
+      self._items.put(_STOP)
+      self._thread.join()
+    self._raise_on_error()
+
+
+def _dispatch(fn: Callable[[E], None], items: queue.Queue,
+              errors: List[Exception], stopped: threading.Event) -> None:
+  """Applies `fn` to queued items until stopped."""
+  while True:
+    try:
+      item = items.get(timeout=1.)
+    except queue.Empty:
+      if stopped.is_set():
+        return
+      continue
+    try:
+      if item is _STOP:
+        return
+      fn(item)
+    except Exception as e:  # pylint: disable=broad-except
+      errors.append(e)
+    finally:
+      items.task_done()